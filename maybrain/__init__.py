@@ -37,6 +37,8 @@ To avoid having to import mayavi you can use, e.g.
 # imports to avoid having to import submodules each time
 #from recipes import *
 from brainObjs import brainObj
+from cohort import cohortObj
+from graphCore import csrGraph
 #from plot import plotObj
 from extraFns import *
 import mbplot
@@ -6,6 +6,7 @@ Module for linking with the Allen brain atlas
 """
 
 import maybrain.brainObjs as mbo
+from maybrain import extraFns
 
 import csv
 from os import path,rename,remove
@@ -20,11 +21,14 @@ class allenBrain:
     """
     def __init__(self, allenSubj, assocMat, delim=",",
                  spatialFile="atlas471_xyz_flip_xy.txt", nodesToExclude=[],
-                 symmetrise=False, mirror=False, convertMNI=False):
+                 symmetrise=False, mirror=False, convertMNI=False, dtype="float64"):
         """
         This object contains two 'brain' network objects, one for the imaging data and
         one for the Allen data. Embedded functions make a comparison between the imaging
         and Allen data by pairing nodes between the two network objects.
+        
+        dtype is the numpy type of the imaging association matrix, which is also
+        used for the temporary probe matrices in writeXMatrix.
         """
       
         self.subj = allenSubj
@@ -102,56 +106,25 @@ class allenBrain:
             self.a.copyHemisphere()
             
         # set up brain with graph properties
-        self.c = mbo.brainObj()
+        self.c = mbo.brainObj(dtype=dtype)
         self.c.importAdjFile(assocMat, delimiter=delim,
                              exclnodes=nodesToExclude)
         self.c.importSpatialInfo(spatialFile)
   
     def comparison(self):
-        # set up dictionary to link nodes from probe data and graph
-        # keys are the mri nodes and values are disctionaries containing two keys: 
-        # key 1= allen, value= (n=id of closest allen node, d=distance to closest allen node)
-        # key 2= mri, value= (n=id of closest other mri node, d=distance to closest mri node)
+        # pair each mri node with the closest allen node, stored as 'pair' in
+        # the node dictionaries of both brains. Allen nodes without a pair are removed.
+
+        # find the closest allen node to each MRI node, reading the coordinates of all the nodes as arrays
+        cNodes = self.c.G.nodes()
+        aNodes = self.a.G.nodes()
+        nearest, dists = extraFns.nearestPoints(self.c.nodeCoords(cNodes), self.a.nodeCoords(aNodes))
 
-        nodeDictMRIs = {}
-      
-        for node in self.c.G.nodes():
-            dOther = (None, 999.) # dummy length of 999
-            dOwn = (None, 999.)
-      
-            for n in self.a.G.nodes():
-                d = np.linalg.norm(np.array(self.c.G.node[node]['xyz'] - np.array(self.a.G.node[n]['xyz'])))
-                if d < dOther[1]:
-                    dOther = (n,d)
-          
-            for n in [v for v in self.c.G.nodes() if not v==node]:
-                d = np.linalg.norm(np.array(self.c.G.node[node]['xyz'] - np.array(self.c.G.node[n]['xyz'])))
-                if d < dOwn[1]:
-                    dOwn = (n,d)
-            nodeDictMRIs[node] = {"allen":dOther, "MRIs":dOwn}
-      
-        # set up dictionary to link nodes from probe data and graph
-        nodeDictAllen = {}
-        for node in self.a.G.nodes():
-            dOther = (None, 999.)
-            dOwn = (None, 999.)
-          
-            for n in self.c.G.nodes():
-                d = np.linalg.norm(np.array(self.a.G.node[node]['xyz'] - np.array(self.c.G.node[n]['xyz'])))
-                if d < dOther[1]:
-                    dOther = (n,d)
-          
-            for n in [v for v in self.a.G.nodes() if not v==node]:
-                d = np.linalg.norm(np.array(self.a.G.node[node]['xyz'] - np.array(self.a.G.node[n]['xyz'])))
-                if d < dOwn[1]:
-                    dOwn = (n,d)
-            nodeDictAllen[node] = {"allen":dOwn, "MRIs":dOther}
-      
         nodePairs = []
         # for each MRI node
-        for node in nodeDictMRIs.keys():
-            # find closest allen node 'n'
-            n = nodeDictMRIs[node]['allen'][0]
+        for node,k,d in zip(cNodes, nearest.tolist(), dists.tolist()):
+            # closest allen node 'n', within a dummy length of 999
+            n = aNodes[k] if d < 999. else None
             self.c.G.node[node]['pair'] = n
             self.a.G.node[n]['pair'] = node
             nodePairs.append((node,n))
@@ -255,7 +228,7 @@ class allenBrain:
        sT = np.max([len(self.sIDDict.values())]) # max numbers of nodes for any region
        
        probeMat = np.memmap(tempMatName,
-                            dtype="float64",
+                            dtype=self.c.dtype,
                             mode="w+",
                             shape=(y,z,sT))
                            
@@ -337,7 +310,7 @@ class allenBrain:
            # create a masked array removing the 0. values
            subjMat = np.ma.array(probeMat[y,:,sT:sT],
                                  mask=probeMat[y,:,sT:sT]==0.,
-                                 dtype="float64")
+                                 dtype=self.c.dtype)
 
            subjMat = (subjMat - np.mean(np.ma.array(subjMat, mask=subjMat==0.))) / np.std(np.ma.array(subjMat, mask=subjMat==0.))
            probeMat[y,:,sT:sT] = subjMat
@@ -351,7 +324,7 @@ class allenBrain:
        # collapse across nodes within regions (averaging across all subjects)
        # probeMat = np.mean(np.ma.array(probeMat, mask=probeMat==0.), axis=3) # this would work, but runs in to memory problems
        sh = probeMat.shape
-       probeMatTemp = np.memmap("probeMatTemp.txt", mode="w+", dtype="float64", shape=sh[:2])
+       probeMatTemp = np.memmap("probeMatTemp.txt", mode="w+", dtype=self.c.dtype, shape=sh[:2])
 
        # write out the standard deviation for each probe if specified
        if sd:
@@ -376,7 +349,7 @@ class allenBrain:
                x = probeMat.shape[1] # number of nodes
                y = len(geneList[gene]) # number of probes
                               
-               geneMat = np.zeros(shape=(x,y), dtype="float64")
+               geneMat = np.zeros(shape=(x,y), dtype=self.c.dtype)
               
                for n,p in enumerate(geneList[gene]): # nb: p is the position of the probe recorded above
                    geneMat[:,n] = probeMat[p,:]
@@ -490,7 +463,7 @@ class multiSubj:
     """
     def __init__(self, assocMat, nodesToExclude=[], delim=" ",
                  subjList=None, spatialFile="parcel_500.txt", symmetrise=False,
-                 convertMNI=False, mirror=True):
+                 convertMNI=False, mirror=True, dtype="float64"):
         if subjList:
             self.subjList = subjList
         else:
@@ -563,56 +536,25 @@ class multiSubj:
         #f.close()
        
         # set up brain with graph properties
-        self.c = mbo.brainObj()
+        self.c = mbo.brainObj(dtype=dtype)
         self.c.importAdjFile(assocMat, delimiter=delim, exclnodes=nodesToExclude)
         self.c.importSpatialInfo(spatialFile)
 
     def comparison(self):
         """
-        set up dictionary to link nodes from probe data and graph
-        keys are the mri nodes and values are dictionaries containing two keys: 
-        key 1= allen, value= (n=id of closest allen node, d=distance to closest allen node)
-        key 2= mri, value= (n=id of closest other mri node, d=distance to closest mri node)
+        pair each mri node with the closest allen node, stored as 'pair' in
+        the node dictionaries of both brains. Allen nodes without a pair are removed.
         """
-        nodeDictMRIs = {}
-       
-        for node in self.c.G.nodes():
-            dOther = (None, 999.) # dummy length of 999
-            dOwn = (None, 999.)
-       
-            for n in self.a.G.nodes():
-                d = np.linalg.norm(np.array(self.c.G.node[node]['xyz'] - np.array(self.a.G.node[n]['xyz'])))
-                if d < dOther[1]:
-                    dOther = (n,d)
-           
-            for n in [v for v in self.c.G.nodes() if not v==node]:
-                d = np.linalg.norm(np.array(self.c.G.node[node]['xyz'] - np.array(self.c.G.node[n]['xyz'])))
-                if d < dOwn[1]:
-                    dOwn = (n,d)
-            nodeDictMRIs[node] = {"allen":dOther, "MRIs":dOwn}
-       
-        # set up dictionary to link nodes from probe data and graph
-        nodeDictAllen = {}
-        for node in self.a.G.nodes():
-            dOther = (None, 999.)
-            dOwn = (None, 999.)
-           
-            for n in self.c.G.nodes():
-                d = np.linalg.norm(np.array(self.a.G.node[node]['xyz'] - np.array(self.c.G.node[n]['xyz'])))
-                if d < dOther[1]:
-                    dOther = (n,d)
-           
-            for n in [v for v in self.a.G.nodes() if not v==node]:
-                d = np.linalg.norm(np.array(self.a.G.node[node]['xyz'] - np.array(self.a.G.node[n]['xyz'])))
-                if d < dOwn[1]:
-                    dOwn = (n,d)
-            nodeDictAllen[node] = {"allen":dOwn, "MRIs":dOther}
-       
+        # find the closest allen node to each MRI node, reading the coordinates of all the nodes as arrays
+        cNodes = self.c.G.nodes()
+        aNodes = self.a.G.nodes()
+        nearest, dists = extraFns.nearestPoints(self.c.nodeCoords(cNodes), self.a.nodeCoords(aNodes))
+
         nodePairs = []
         # for each MRI node
-        for node in nodeDictMRIs.keys():
-            # find closest allen node 'n'
-            n = nodeDictMRIs[node]['allen'][0]
+        for node,k,d in zip(cNodes, nearest.tolist(), dists.tolist()):
+            # closest allen node 'n', within a dummy length of 999
+            n = aNodes[k] if d < 999. else None
             self.c.G.node[node]['pair'] = n
             self.a.G.node[n]['pair'] = node
             nodePairs.append((node,n))
@@ -711,7 +653,7 @@ class multiSubj:
         sT = np.max([np.max([len(v) for v in self.sIDDict[subj].values()]) for subj in self.sIDDict.keys()]) # max numbers of nodes for any region
         
         probeMat = np.memmap(tempMatName,
-                             dtype="float64",
+                             dtype=self.c.dtype,
                              mode="w+",
                              shape=(y,z,sT*x))
                             
@@ -796,7 +738,7 @@ class multiSubj:
                 # create a masked array removing the 0. values
                 subjMat = np.ma.array(probeMat[y,:,sT*x:sT*x+sT],
                                       mask=probeMat[y,:,sT*x:sT*x+sT]==0.,
-                                      dtype="float64")
+                                      dtype=self.c.dtype)
 
                 subjMat = (subjMat - np.mean(np.ma.array(subjMat, mask=subjMat==0.))) / np.std(np.ma.array(subjMat, mask=subjMat==0.))
                 probeMat[y,:,sT*x:sT*x+sT] = subjMat
@@ -810,7 +752,7 @@ class multiSubj:
         # collapse across nodes within regions (averaging across all subjects)
 #        probeMat = np.mean(np.ma.array(probeMat, mask=probeMat==0.), axis=3) # this would work, but runs in to memory problems
         sh = probeMat.shape
-        probeMatTemp = np.memmap("probeMatTemp.txt", mode="w+", dtype="float64", shape=sh[:2])
+        probeMatTemp = np.memmap("probeMatTemp.txt", mode="w+", dtype=self.c.dtype, shape=sh[:2])
 
         # write out the standard deviation for each probe if specified
         if sd:
@@ -838,7 +780,7 @@ class multiSubj:
                 x = probeMat.shape[1] # number of nodes
                 y = len(geneList[gene]) # number of probes
                                
-                geneMat = np.zeros(shape=(x,y), dtype="float64")
+                geneMat = np.zeros(shape=(x,y), dtype=self.c.dtype)
                
                 for n,p in enumerate(geneList[gene]): # nb: p is the position of the probe recorded above
                     geneMat[:,n] = probeMat[p,:]
@@ -24,11 +24,21 @@ import numpy as np
 from networkx.algorithms import centrality
 from networkx.algorithms import components
 import random
+import json
+from os import path, makedirs, listdir, remove
+import re
+from copy import deepcopy
 from string import split
 import extraFns
+import graphCore
+import columns
 
 #from mayavi.core.ui.api import MlabSceneModel, SceneEditor
 
+# names of the arrays that exportBrain can write
+brainArrayNames = re.compile(r'^(adjMat|packedAdj|edges|weights|coords|sparse(Data|Indices|Indptr|Shape)'
+                             r'|(node|edge)\d+(Index)?|(column|edgeColumn)\d+(Codes|Categories|Keys)?)$')
+
 class brainObj:
     """
     A class that defines a brain network created from an adjacency matrix and spatial inforamtion 
@@ -39,19 +49,61 @@ class brainObj:
         - layout for plotting
         - counter for iterations of any subsequent process
         
+    G is made lazily when the brain is made with core=True. setCore removes
+    G from the instance and keeps the edges in self.core (an array graph, see
+    graphCore.csrGraph) and the nodes in self.nodeGraph, a graph without
+    edges. The next time self.G is used, __getattr__ (only called for missing
+    attributes) adds the edges to nodeGraph and sets it as G again. So:
+        - anything that reads self.G, including hasattr(self, 'G') or
+          getattr, makes G. Use coreCurrent() to check which form holds the
+          edges without making G.
+        - a reference to G kept from before setCore is not the brain's graph
+          any more; get self.G again after thresholding.
+        - code that copies or pickles the instance dictionary gets whichever
+          form is current, which is still a valid brain.
+    
+    The adjacency matrix of a fork is made lazily in the same way. While the
+    matrix is shared with the brain it was forked from, syncAdjMat keeps the
+    edge changes in the journal and moves the matrices to self.sharedAdj.
+    The next time adjMat, packedAdj or sparseAdj is used, __getattr__ puts
+    them back and applies the changes, copying the matrix.
     """
     
-    def __init__(self, directed=False):
+    def __init__(self, directed=False, dtype="float64", core=False):
         ''' 
         Initialise the brain model.
-    
+        
+        dtype is the numpy type of the adjacency matrix and any copies made of
+        it, e.g. "float32" or "float16" to fit large matrices in memory.
+        
+        If core is True, thresholded edges are kept in self.core, a compact
+        array graph (see graphCore.csrGraph), and the networkx graph G is only
+        made from it when G is first used (see setCore).
         '''        
         
         # create an empty graph
         self.directed = directed # is this a directed graph or not?
+        self.dtype = np.dtype(dtype) # type of the adjacency matrix values
         
         # initialise global variables
         self.adjMat = None # adjacency matrix, containing weighting of edges. Should be square.
+        self.sparseAdj = None # scipy sparse adjacency matrix for brains imported from edge lists
+        self.packedAdj = None # packed upper triangle of the adjacency matrix for undirected brains
+        self.coords = None # Nx3 array of node coordinates, row n is for node n
+        self.nodeProps = {} # node properties stored as arrays, element n is for node n
+        self.edgeProps = {} # edge properties stored as arrays of edge keys and values, see setEdgePropertyArray
+        self.adjVersion = 0 # incremented whenever the adjacency matrix is changed
+        self.weightIndex = None # sorted weights of the adjacency matrix, see sortedWeights
+        self.weightIndexKey = None # version of the adjacency matrix the weight index was made for
+        self.neighbourIndex = None # strongest neighbours of each node, see nearestNeighbours
+        self.neighbourIndexKey = None # version of the adjacency matrix the neighbour index was made for
+        self.edgeJournal = [] # changes to edges of G not yet applied to the adjacency matrix, see logEdge
+        self.graphVersion = 0 # incremented whenever the edges of G are changed
+        self.useCore = core # keep thresholded edges in self.core rather than G
+        self.core = None # array graph of the edges, see setCore
+        self.forkBase = None # array graph of G shared by forks, see forkCore
+        self.pathIndex = None # all pairs shortest path lengths, see pathLengths
+        self.pathIndexKey = None # version of the edges the path lengths were found for
 #        self.threshold = 0 # value of threshold for including edges -- this line should be commented, a threshold of 0 is likely to be wrong.
         
         # need to define the following, what do they do???
@@ -85,6 +137,23 @@ class brainObj:
             # non-directional case
             self.G = nx.Graph()
 
+    def __getattr__(self, name):
+        ''' make G from the array graph the first time it is used (see setCore),
+            and apply the edge changes kept for a shared adjacency matrix the
+            first time it is used (see syncAdjMat) '''
+        if name == 'G' and 'nodeGraph' in self.__dict__:
+            G = self.__dict__.pop('nodeGraph')
+            self.core.toGraph(G)
+            self.G = G
+            return G
+        if name in ['adjMat', 'packedAdj', 'sparseAdj'] and 'sharedAdj' in self.__dict__:
+            # matrices set since they were moved are kept
+            for n,a in zip(['adjMat', 'packedAdj', 'sparseAdj'], self.__dict__.pop('sharedAdj')):
+                self.__dict__.setdefault(n, a)
+            self.syncAdjMat(deferShared=False)
+            return self.__dict__[name]
+        raise AttributeError(name)
+
     ## ================================================
 
     ##### File inputs and outputs
@@ -92,45 +161,403 @@ class brainObj:
     ### edges and nodes
 
     #!! readAdjFile removed           
-    def importAdjFile(self, fname, delimiter = None, exclnodes=[], naVals=["NA"]):
-        ''' get the adjacency data from a file and return as an array '''
+    def importAdjFile(self, fname, delimiter = None, exclnodes=[], naVals=["NA"], blockSize=None, mmapFile=None, packed=False):
+        ''' get the adjacency data from a file and return as an array
+        
+            For very large matrices, blockSize streams the file in blocks of that
+            many rows straight in to adjMat so the text is never held in memory
+            all at once. If mmapFile is given, adjMat is a numpy memmap stored in
+            that file rather than an array in memory.
+            
+            For undirected brains, packed=True only keeps the upper triangle of
+            the matrix, in self.packedAdj (see extraFns.packIndex), which halves
+            the memory needed. adjMat is then left as None and only made by
+            getAdjMat for functions that need the full matrix.
+        '''
         self.exclnodes=exclnodes
-        
-        # open file
-        f = open(fname,"rb")
-        reader = f.readlines()        
-
-        # get line that data starts in 
-        startLine = 0
-        for line in reader:
-            if 'begins line' in str(line):
-                lstr = str(line)
-                whereLabel = lstr.find('begins line')
-                startLine = int(lstr[whereLabel + 12])-1
-                break
+        exclSet = set(exclnodes)
+        
+        if packed and self.directed:
+            print "A packed matrix can only be used for undirected brains, using the full matrix"
+            packed = False
+
+        if blockSize:
+            # scan the file for the size of the matrix, then parse it block by block
+            startLine, nRows, nCols = extraFns.adjFileShape(fname, delimiter)
+            if packed:
+                self.packedAdj = self.allocAdjMat((nRows*(nRows-1)//2,), mmapFile)
+                self.adjMat = None
+            else:
+                self.adjMat = self.allocAdjMat((nRows, nCols), mmapFile)
+
+            r = 0
+            for lines in extraFns.readAdjBlocks(fname, startLine, blockSize):
+                if packed:
+                    block = np.empty((len(lines), nCols), dtype=self.dtype)
+                else:
+                    block = self.adjMat[r:r+len(lines)]
+                extraFns.parseAdjLines(lines, block, delimiter=delimiter, naVals=naVals, firstRow=r)
+
+                # null values of excluded nodes in this block
+                if exclnodes:
+                    block[:,exclnodes] = np.nan
+                    block[[v-r for v in exclSet if r <= v < r+len(lines)],:] = np.nan
+                    
+                # copy the part of each row above the diagonal in to the packed triangle
+                if packed:
+                    for i in range(r, min(r+len(lines), nRows-1)):
+                        start = extraFns.packIndex(i, i+1, nRows)
+                        self.packedAdj[start:start+nRows-i-1] = block[i-r,i+1:]
+                r += len(lines)
+
+        else:
+            # get data, ignoring header and blank lines
+            lines = extraFns.readAdjLines(fname)
+            nRows = len(lines)
+
+            # set adjacency matrix, parsing all the lines in to a preallocated array
+            if packed:
+                self.adjMat = self.allocAdjMat((nRows, extraFns.countColumns(lines[0], delimiter)))
+            else:
+                self.adjMat = self.allocAdjMat((nRows, extraFns.countColumns(lines[0], delimiter)), mmapFile)
+            extraFns.parseAdjLines(lines, self.adjMat, delimiter=delimiter, naVals=naVals)
+            del(lines)
+
+            # update adjacency matrix to null values of excluded nodes
+            if exclnodes:
+                self.adjMat[:,exclnodes]=np.nan
+                self.adjMat[exclnodes,:]=np.nan
                 
-        # get data and convert to lists of floats
-        linesStr = reader[startLine:]
-        lines = []
-        for l in linesStr:
-            while l[-1] in ('\n', '\t'):
-                l = l[:-1]
-            lines.append(map(float, [v if v not in naVals else np.nan for v in split(l, sep=delimiter)]))
-
-        # close file                
-        f.close()
+            if packed:
+                self.packAdjMat(mmapFile)
+
+        if mmapFile and packed:
+            self.packedAdj.flush()
+        elif mmapFile:
+            self.adjMat.flush()
+
+        self.adjMatChanged()
 
-        # set adjacency matrix
-        self.adjMat = np.array(lines)
-        
         # add nodes
-        self.G.add_nodes_from([v for v in range(len(lines)) if not v in exclnodes])
+        self.G.add_nodes_from([v for v in range(nRows) if not v in exclSet])
+
+    def allocAdjMat(self, shape, mmapFile=None):
+        ''' create an empty adjacency matrix of the brain's dtype, held in the file mmapFile as a numpy memmap if given '''
+        if mmapFile:
+            return np.memmap(mmapFile, dtype=self.dtype, mode="w+", shape=shape)
+        else:
+            return np.empty(shape, dtype=self.dtype)
 
-        # update adjacency matrix to null values of excluded nodes
+    def importEdgeList(self, fname, delimiter=None, nNodes=None, exclnodes=[], naVals=["NA"]):
+        ''' get the edges from a file of weighted edges, two node indices and a
+            weight on each line, e.g.:
+                
+            0 1 0.53
+            0 5 0.21
+            
+            If no weights are given, they are taken as 1. The edges are held in
+            a scipy sparse matrix, self.sparseAdj, and added to G directly, so
+            memory and loading time scale with the number of edges rather than
+            the number of nodes squared. adjMat is only created from the sparse
+            matrix by getAdjMat for functions that need a dense matrix.
+            
+            Weights of repeated edges are summed, so for undirected brains each
+            edge should only appear once. nNodes gives the number of nodes
+            if the last nodes have no edges.
+        '''
+        from scipy import sparse
+        self.exclnodes=exclnodes
+        
+        # get data, ignoring header and blank lines
+        table = extraFns.readAdjFile(fname, delimiter=delimiter, naVals=naVals)
+        nCols = table.shape[1]
+        
+        i = table[:,0].astype(int)
+        j = table[:,1].astype(int)
+        if nCols > 2:
+            w = table[:,2].astype(self.dtype)
+        else:
+            w = np.ones(len(table), dtype=self.dtype)
+        
+        if nNodes is None:
+            nNodes = max(np.max(i), np.max(j)) + 1
+        
+        # leave out edges without weights or to excluded nodes
+        keep = ~np.isnan(w)
         if exclnodes:
-            for en in exclnodes:
-                self.adjMat[:,en]=np.nan
-                self.adjMat[en,:]=np.nan
+            keep &= ~np.in1d(i, exclnodes) & ~np.in1d(j, exclnodes)
+        i, j, w = i[keep], j[keep], w[keep]
+        
+        # undirected edges are stored in both directions, as in a symmetric association matrix
+        if not self.directed:
+            offDiag = i!=j
+            i, j, w = np.concatenate((i, j[offDiag])), np.concatenate((j, i[offDiag])), np.concatenate((w, w[offDiag]))
+        
+        self.sparseAdj = sparse.coo_matrix((w, (i, j)), shape=(nNodes, nNodes)).tocsr()
+        self.adjMat = None
+        self.adjMatChanged()
+        
+        # add nodes and edges
+        exclSet = set(exclnodes)
+        self.G.add_nodes_from([v for v in range(nNodes) if not v in exclSet])
+        self.threshold = np.min(self.edgeWeights())
+        self.applyThreshold(thresholdType='tVal', value=self.threshold)
+        
+    def packAdjMat(self, mmapFile=None):
+        ''' keep only the upper triangle of the adjacency matrix of an undirected
+            brain, in self.packedAdj, to halve the memory needed. The full matrix
+            is made again by getAdjMat. '''
+        
+        if self.directed:
+            print "A packed matrix can only be used for undirected brains"
+            return
+        
+        weights = extraFns.undirectedFlatten(self.adjMat)
+        self.packedAdj = self.allocAdjMat(weights.shape, mmapFile)
+        self.packedAdj[:] = weights
+        self.adjMat = None
+        
+    def getAdjMat(self):
+        ''' get the dense adjacency matrix, creating it from the sparse adjacency
+            matrix if the brain was imported from an edge list. Missing edges are NaN. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            S = self.sparseAdj.tocoo()
+            self.adjMat = np.empty(S.shape, dtype=self.dtype)
+            self.adjMat[:] = np.nan
+            self.adjMat[S.row, S.col] = S.data
+            
+            # the dense matrix now holds the weights
+            self.sparseAdj = None
+        
+        elif self.adjMat is None and not self.packedAdj is None:
+            self.adjMat = extraFns.unpackTriangle(self.packedAdj)
+            self.packedAdj = None
+        
+        return self.adjMat
+        
+    def edgeWeights(self):
+        ''' get an array of the weights of all possible edges, leaving out NaNs.
+            For undirected brains only the upper triangle of the matrix is used. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            from scipy import sparse
+            if self.directed:
+                weights = self.sparseAdj.data
+            else:
+                weights = sparse.triu(self.sparseAdj, k=1).data
+        elif self.adjMat is None and not self.packedAdj is None:
+            weights = self.packedAdj
+        elif not self.directed:
+            weights = np.array(extraFns.undirectedFlatten(self.adjMat))
+        else:
+            weights = np.array(self.adjMat.flatten())
+        
+        return weights[~np.isnan(weights)]
+
+    def adjRow(self, v):
+        ''' get the weights of the edges of node v to every node, NaN where there
+            is no edge. For undirected brains the weight of an edge is taken from
+            the upper triangle of the matrix, as in applyThreshold. The full matrix
+            isn't needed, so this works on packed and sparse matrices. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            S = self.sparseAdj.getrow(v).tocoo()
+            row = np.empty(S.shape[1], dtype=self.dtype)
+            row[:] = np.nan
+            row[S.col] = S.data
+            
+        elif self.adjMat is None and not self.packedAdj is None:
+            n = extraFns.packedSize(self.packedAdj)
+            row = np.empty(n, dtype=self.packedAdj.dtype)
+            row[:v] = self.packedAdj[extraFns.packIndex(np.arange(v), v, n)]
+            row[v] = np.nan
+            if v < n-1:
+                start = extraFns.packIndex(v, v+1, n)
+                row[v+1:] = self.packedAdj[start:start+n-v-1]
+            
+        elif self.directed:
+            row = np.array(self.adjMat[v])
+            
+        else:
+            row = np.array(self.adjMat[v])
+            row[:v] = self.adjMat[:v,v]
+        
+        row[v] = np.nan
+        return row
+
+    def adjBlocks(self, blockSize=1000):
+        ''' generator giving the possible edges (those with weights that aren't NaN)
+            of blockSize rows of the adjacency matrix at a time, as arrays of start
+            nodes, end nodes and weights. Undirected edges are taken from the upper
+            triangle. Only one block of the matrix is read in to memory at a time,
+            so adjMat can be a memmap larger than memory. '''
+        
+        n = self.adjMat.shape[1]
+        for start in range(0, len(self.adjMat), blockSize):
+            W = np.array(self.adjMat[start:start+blockSize])
+            rows = np.arange(start, start+len(W))[:,np.newaxis]
+            
+            if self.directed:
+                keep = ~np.isnan(W) & (rows != np.arange(n))
+            else:
+                keep = ~np.isnan(W) & (rows < np.arange(n))
+            i, j = np.where(keep)
+            
+            yield i+start, j, W[i,j]
+            
+    def blockThreshold(self, edgeNum=None, edgePC=None, blockSize=1000):
+        ''' get the threshold that keeps the edgeNum strongest edges, or edgePC
+            percent of the possible edges, reading blockSize rows of adjMat at a
+            time. Returns the threshold and the number of edges.
+            
+            Only the strongest edgeNum weights found so far are kept as the blocks
+            are read, so memory depends on the number of edges rather than the size
+            of the matrix. For edgePC the possible edges are counted in a first
+            pass. '''
+        
+        if not edgePC is None:
+            nEdges = sum([len(w) for i,j,w in self.adjBlocks(blockSize)])
+            edgeNum = (edgePC/100.) * nEdges
+        edgeNum = int(edgeNum)
+        
+        top = np.zeros(0, dtype=self.dtype)
+        nEdges, minW, maxW = 0, np.inf, -np.inf
+        for i,j,w in self.adjBlocks(blockSize):
+            if not len(w):
+                continue
+            nEdges += len(w)
+            minW, maxW = min(minW, np.min(w)), max(maxW, np.max(w))
+            
+            if edgeNum > 0:
+                # keep the strongest edgeNum weights so far
+                if len(top) == edgeNum:
+                    w = w[w > np.min(top)]
+                top = np.concatenate((top, w))
+                if len(top) > edgeNum:
+                    top = np.partition(top, len(top)-edgeNum)[len(top)-edgeNum:]
+        
+        if edgeNum > nEdges:
+            # case where all edges are included
+            threshold = minW
+        elif edgeNum <= 0:
+            # case where number of edges is 0 or less
+            threshold = maxW + 0.5
+        else:
+            # case where some edges are included
+            threshold = np.min(top)
+            
+        return threshold, edgeNum
+
+    def adjMatChanged(self):
+        ''' mark the adjacency matrix as changed, so that anything cached from it
+            (e.g. the sorted weight index) is made again. This is done by the
+            functions that alter the matrix, but should also be called after
+            changing adjMat directly. Edge changes waiting in the journal are
+            dropped, as they were for the old matrix. '''
+        
+        if 'sharedAdj' in self.__dict__:
+            names = ['adjMat', 'packedAdj', 'sparseAdj']
+            if any([n in self.__dict__ for n in names]):
+                # the shared matrix has been replaced, so its changes go with it
+                for n,a in zip(names, self.__dict__.pop('sharedAdj')):
+                    self.__dict__.setdefault(n, a)
+            else:
+                # the changes kept for the shared matrix are applied to it
+                self.adjMat
+        
+        self.adjVersion += 1
+        self.weightIndex = None
+        self.neighbourIndex = None
+        self.edgeJournal = []
+        
+    def graphChanged(self):
+        ''' mark the edges of G or their properties as changed, so that anything
+            cached from G is made again. This is done by the functions that
+            alter the edges, but should also be called after changing G
+            directly. '''
+        
+        self.graphVersion += 1
+        
+    def adjKey(self):
+        ''' key identifying the current adjacency matrix, its version and which array holds it '''
+        
+        return (self.adjVersion, id(self.adjMat), id(self.packedAdj), id(self.sparseAdj))
+        
+    def sortedWeights(self):
+        ''' get the weights of all possible edges (see edgeWeights) sorted in ascending
+            order. The sorted weights are kept until the adjacency matrix changes, so
+            repeated thresholds only need a lookup. '''
+        
+        if self.weightIndex is None or self.weightIndexKey != self.adjKey():
+            self.weightIndex = np.sort(self.edgeWeights())
+            self.weightIndexKey = self.adjKey()
+        
+        return self.weightIndex
+        
+    def edgeThreshold(self, edgeNum=None, edgePC=None, blockSize=None):
+        ''' get the threshold that keeps the edgeNum strongest edges, or edgePC
+            percent of the possible edges. Returns the threshold and the number of
+            edges.
+            
+            The first threshold for an adjacency matrix uses a linear time selection
+            (numpy.partition) rather than sorting all of the weights. If a second
+            threshold is needed for the same matrix, as in a sweep of thresholds,
+            the weights are sorted once (see sortedWeights) and every threshold
+            after that is a lookup. If blockSize is given, the matrix is read a
+            block at a time instead (see blockThreshold). '''
+        
+        if blockSize and not self.adjMat is None:
+            return self.blockThreshold(edgeNum=edgeNum, edgePC=edgePC, blockSize=blockSize)
+        
+        key = self.adjKey()
+        if self.weightIndexKey == key:
+            # a threshold has already been found for this matrix
+            weights = self.sortedWeights()
+            isSorted = True
+        else:
+            weights = self.edgeWeights()
+            self.weightIndex = None
+            self.weightIndexKey = key
+            isSorted = False
+        
+        nEdges = len(weights)
+        if not edgePC is None:
+            edgeNum = (edgePC/100.) * nEdges
+        edgeNum = int(edgeNum)
+        
+        if edgeNum > nEdges:
+            # case where all edges are included
+            threshold = weights[0] if isSorted else np.min(weights)
+        elif edgeNum <= 0:
+            # case where number of edges is 0 or less
+            threshold = (weights[-1] if isSorted else np.max(weights)) + 0.5
+        elif isSorted:
+            # case where some edges are included
+            threshold = weights[-edgeNum]
+        else:
+            weights.partition(nEdges-edgeNum)
+            threshold = weights[nEdges-edgeNum]
+            
+        return threshold, edgeNum
+
+    def weightDensities(self, weights):
+        ''' get the lowest densities, as percentages for edgePC in applyThreshold,
+            that keep edges of the given weights. This is the inverse of
+            edgeThreshold, using the same possible edges (see sortedWeights). '''
+        
+        sortedW = self.sortedWeights()
+        nEdges = len(sortedW)
+        
+        # the edge is kept once the threshold reaches the strongest weight tied with it
+        edgeNums = nEdges - np.searchsorted(sortedW, weights, side='right') + 1
+        
+        # nudged up where rounding would lose the edge in edgeThreshold
+        densities = 100. * edgeNums / nEdges
+        short = (densities/100. * nEdges).astype(int) < edgeNums
+        densities[short] = np.nextafter(densities[short], np.inf)
+        
+        return densities
 
     #!! After much deliberation, this function was kept from the master, but renamed
     def importSpatialInfo(self, fname, delimiter=None, convertMNI=False):
@@ -146,26 +573,47 @@ class brainObj:
             print "Problem with opening file: "+errordetails                
             return                
                
-        # get data from file
-        lines = f.readlines()
-        nodeCount=0
-        for line in lines:
-            if delimiter:
-                l = split(line,sep=delimiter)
-            else:
-                l = split(line)
+        # get data from file, each line is a label and x, y, z values
+        lines = [split(l, sep=delimiter) for l in f.readlines() if l.strip()]
+        f.close()
+        labels = [l[0] for l in lines]
+        coords = np.array([l[1:4] for l in lines], dtype=float)
 
-            if convertMNI:
-                l[1] = 45 - (float(l[1])/2)
-                l[2] = 63 + (float(l[2])/2)
-                l[3] = 36 + (float(l[3])/2)
+        if convertMNI:
+            coords = np.array([45., 63., 36.]) + coords * np.array([-0.5, 0.5, 0.5])
 
-            if nodeCount in self.G.nodes():
-                self.G.node[nodeCount]["xyz"]=(float(l[1]),float(l[2]),float(l[3]))
-                self.G.node[nodeCount]["anatlabel"]=l[0]
+        self.setCoords(coords, labels)
+
+    def setCoords(self, coords, labels=None):
+        '''
+        Set the Nx3 array of node coordinates, self.coords, where row n holds the
+        coordinates of node n. For compatibility, each node's 'xyz' property is
+        a view of its row, and anatlabel is set from labels if given.
+        '''
+        self.coords = np.ascontiguousarray(coords, dtype=float)
+
+        for n in self.G.nodes():
+            if isinstance(n, (int, long)) and 0 <= n < len(self.coords) and not np.isnan(self.coords[n,0]):
+                self.G.node[n]["xyz"] = self.coords[n]
+                if labels:
+                    self.G.node[n]["anatlabel"] = labels[n]
+
+    def nodeCoords(self, nodes):
+        ''' get an array of coordinates for a list of nodes. These are taken
+            from self.coords while each node's xyz is still a view of its row
+            (see setCoords), otherwise from xyz, e.g. if it has been replaced '''
+
+        nodeData = self.nodeGraph.node if 'nodeGraph' in self.__dict__ else self.G.node
+        xyz = [nodeData[n]['xyz'] for n in nodes]
+        if not self.coords is None:
+            # where each row of coords starts in memory
+            start, step = self.coords.ctypes.data, self.coords.strides[0]
+            isView = [isinstance(v, np.ndarray) and isinstance(n, (int, long)) and v.ctypes.data == start + n*step for n,v in zip(nodes, xyz)]
+        if not self.coords is None and all(isView):
+            return self.coords[np.array(nodes, dtype=int)].reshape((len(nodes),3))
+        else:
+            return np.array(xyz, dtype=float).reshape((len(nodes),3))
 
-            nodeCount+=1
-                        
     #!! in merge import Properties taken from dev2
     def importProperties(self, filename):
         ''' add properties from a file. first lines should contain the property 
@@ -217,7 +665,6 @@ class brainObj:
             except ValueError:
                 value[-1] = str(value[-1])
                 value[-1] = extraFns.stripString(value[-1])
-                print(value[-1])
             
             # get data
             if mode=='nodes':
@@ -237,6 +684,148 @@ class brainObj:
         return prop # required for GUI
                     
         
+    def importPropertyTable(self, fname, delimiter=None, naVals=["NA"], edges=False):
+        ''' add many node properties from a table. The first line contains the 
+            property names and the following lines a node index then a value
+            for each property, e.g.:
+            
+            node thickness module label
+            0    2.51      1      frontal
+            1    2.73      2      parietal
+            
+            The type of each column (int, float or string) is inferred and
+            it is stored as an array in self.nodeProps, indexed by node. Values
+            in naVals and nodes not in the table are NaN, or missing for strings,
+            which are stored as categorical columns (see columns.categorical).
+            
+            If edges is True, each line starts with the two nodes of an edge
+            instead and the properties are stored in self.edgeProps (see
+            setEdgePropertyArray).
+        '''
+        
+        f = open(fname, "rb")
+        lines = [l.rstrip('\r\n') for l in f.readlines() if l.strip()]
+        f.close()
+        
+        nInd = 2 if edges else 1
+        props = lines[0].split(delimiter)[nInd:]
+        table = np.array([l.split(delimiter) for l in lines[1:]])
+        if table.ndim != 2 or table.shape[1] != len(props)+nInd:
+            raise ValueError('property table rows do not all have ' + str(len(props)+nInd) + ' values')
+        
+        if edges:
+            i, j = table[:,0].astype(int), table[:,1].astype(int)
+            for n,prop in enumerate(props):
+                self.setEdgePropertyArray(prop, i, j, extraFns.typedColumn(table[:,n+2], naVals))
+            return props
+        
+        nodes = table[:,0].astype(int)
+        if self.adjMat is None:
+            nNodes = np.max(nodes)+1
+        else:
+            nNodes = max(len(self.adjMat), np.max(nodes)+1)
+        
+        for n,prop in enumerate(props):
+            self.setNodePropertyArray(prop, nodes, extraFns.typedColumn(table[:,n+1], naVals), nNodes)
+        
+        return props
+        
+    def setNodePropertyArray(self, prop, nodes, vals, nNodes=None):
+        ''' store the values of a property for a list of nodes as an array in self.nodeProps '''
+        
+        if nNodes is None:
+            nNodes = np.max(nodes)+1
+        
+        vals = columns.makeColumn(vals)
+        if isinstance(vals, columns.categorical):
+            # strings are stored as categories, missing where there isn't a value
+            codes = np.zeros(nNodes, dtype=np.int32) - 1
+            codes[nodes] = vals.codes
+            self.nodeProps[prop] = columns.categorical(codes=codes, categories=vals.categories)
+            return
+        elif vals.dtype.kind in 'iu' and len(np.unique(nodes)) < nNodes:
+            # integers can't hold missing values
+            col = np.zeros(nNodes, dtype=float)
+            col[:] = np.nan
+        else:
+            col = np.zeros(nNodes, dtype=vals.dtype)
+            if vals.dtype.kind == 'f':
+                col[:] = np.nan
+        
+        col[nodes] = vals
+        self.nodeProps[prop] = col
+        
+    def nodePropertyArray(self, prop, nodes):
+        ''' get an array of the values of a property for a list of nodes if it is stored
+            as an array, i.e. 'x', 'y' or 'z' from self.coords or a property in self.nodeProps,
+            and a boolean array of which nodes have a value. Returns None otherwise. '''
+        
+        if prop in ['x', 'y', 'z'] and not self.coords is None:
+            try:
+                vals = self.nodeCoords(nodes)[:,['x', 'y', 'z'].index(prop)]
+            except KeyError:
+                return None
+            return vals, ~np.isnan(vals)
+        
+        elif prop in self.nodeProps:
+            col = self.nodeProps[prop]
+            if all([isinstance(v, (int, long)) and 0 <= v < len(col) for v in nodes]):
+                inds = np.array(nodes, dtype=int)
+                return col[inds], columns.hasValues(col, inds)
+        
+        return None
+        
+    def setEdgePropertyArray(self, prop, i, j, vals):
+        ''' store the values of a property for the edges from i to j as a column in
+            self.edgeProps, replacing any values already stored for those edges.
+            
+            The column is kept with an array of the edge keys (see
+            extraFns.edgeKeys) in ascending order, so the values for a list of
+            edges are found by a binary search (see edgePropertyArray). '''
+        
+        keys = extraFns.edgeKeys(i, j, self.directed)
+        vals = columns.makeColumn(vals)
+        
+        if prop in self.edgeProps:
+            # keep the values of edges not given this time
+            oldKeys, oldCol = self.edgeProps[prop]
+            keep = ~np.in1d(oldKeys, keys)
+            keys = np.concatenate((oldKeys[keep], keys))
+            vals = columns.concatenate(columns.take(oldCol, np.where(keep)[0]), vals)
+        
+        # sort by key, the last value given for an edge is the one kept
+        keys, last = np.unique(keys[::-1], return_index=True)
+        self.edgeProps[prop] = (keys, columns.take(vals, len(vals)-1-last))
+        
+    def edgePropertyArray(self, prop, edges):
+        ''' get an array of the values of a property stored in self.edgeProps for a
+            list of edges, and a boolean array of which edges have a value.
+            Returns None if the property isn't stored as an array. '''
+        
+        if not prop in self.edgeProps:
+            return None
+        
+        keys, col = self.edgeProps[prop]
+        edges = list(edges)
+        isInt = [isinstance(a, (int, long, np.integer)) and isinstance(b, (int, long, np.integer)) for a,b in edges]
+        if not all(isInt):
+            # nodes that aren't integers (e.g. after copyHemisphere) can't have stored values
+            k = np.where(isInt)[0]
+            vals = np.zeros(len(edges), dtype=col.dtype)
+            has = np.zeros(len(edges), dtype=bool)
+            if len(k):
+                vals[k], has[k] = self.edgePropertyArray(prop, [edges[v] for v in k])
+            return vals, has
+        
+        edges = np.array(edges, dtype=int).reshape((-1,2))
+        k = extraFns.edgeKeys(edges[:,0], edges[:,1], self.directed)
+        
+        if not len(keys):
+            return np.zeros(len(k)), np.zeros(len(k), dtype=bool)
+        
+        pos = np.minimum(np.searchsorted(keys, k), len(keys)-1)
+        return col[pos], (keys[pos] == k) & columns.hasValues(col, pos)
+        
     def addNodeProperties(self, propertyName, nodeList, propList):
         ''' add properties to nodes, reading from a list of nodes and a list of 
             corresponding properties '''
@@ -260,8 +849,473 @@ class brainObj:
                 self.G.edge[e[0]][e[1]][propertyName] = p
             except KeyError:
                 print('edge property assignment failed: ' + propertyName + ' ' + str(e) + ' ' + str(p))
+        
+        self.graphChanged()
+
+
+    ### native binary format
+
+    def exportBrain(self, dirName):
+        '''
+        Save the brain in maybrain's own binary format, a directory of numpy
+        files. The adjacency matrix is saved as it is so that it can be memory
+        mapped when it is opened again with importBrain. Node coordinates,
+        edges, weights and properties are saved as arrays, with the threshold
+        and directedness in info.json.
+        '''
+        if not path.exists(dirName):
+            makedirs(dirName)
+
+        if not self.adjMat is None:
+            np.save(path.join(dirName, 'adjMat.npy'), self.adjMat)
+        if not self.packedAdj is None:
+            np.save(path.join(dirName, 'packedAdj.npy'), self.packedAdj)
+
+        info, arrays = self.graphToArrays()
+        arrays.update(self.sparseToArrays())
+        for name in arrays.keys():
+            np.save(path.join(dirName, name+'.npy'), arrays[name])
+
+        # remove arrays left by an earlier export that this brain doesn't have,
+        # which importBrain would otherwise read
+        written = arrays.keys()
+        if not self.adjMat is None:
+            written.append('adjMat')
+        if not self.packedAdj is None:
+            written.append('packedAdj')
+        for fname in listdir(dirName):
+            name = fname[:-4]
+            if fname.endswith('.npy') and brainArrayNames.match(name) and not name in written:
+                remove(path.join(dirName, fname))
+
+        f = open(path.join(dirName, 'info.json'), 'w')
+        json.dump(info, f)
+        f.close()
+
+    def importBrain(self, dirName, mmapMode='c'):
+        '''
+        Open a brain saved with exportBrain, replacing the current graph.
+
+        mmapMode is passed to numpy.load for the adjacency matrix: 'r' opens it
+        read only so that several processes can share the same pages, 'c' (the
+        default) is copy-on-write so that the matrix can be changed without
+        altering the file and None reads the whole matrix in to memory.
+        '''
+        f = open(path.join(dirName, 'info.json'), 'r')
+        info = json.load(f)
+        f.close()
+
+        if path.exists(path.join(dirName, 'adjMat.npy')):
+            self.adjMat = np.load(path.join(dirName, 'adjMat.npy'), mmap_mode=mmapMode)
+        else:
+            self.adjMat = None
+
+        if path.exists(path.join(dirName, 'packedAdj.npy')):
+            self.packedAdj = np.load(path.join(dirName, 'packedAdj.npy'), mmap_mode=mmapMode)
+        else:
+            self.packedAdj = None
+
+        names = ['edges', 'weights', 'coords']
+        names.extend(['node'+str(n) for n in range(len(info['nodeProps']))])
+        names.extend(['node'+str(n)+'Index' for n in range(len(info['nodeProps']))])
+        names.extend(['edge'+str(n) for n in range(len(info['edgeProps']))])
+        names.extend(['edge'+str(n)+'Index' for n in range(len(info['edgeProps']))])
+        for n in range(len(info['nodeColumns'])):
+            names.extend(columns.columnArrayNames('column'+str(n)))
+        for n in range(len(info.get('edgeColumns', []))):
+            names.append('edgeColumn'+str(n)+'Keys')
+            names.extend(columns.columnArrayNames('edgeColumn'+str(n)))
+        arrays = {v:np.load(path.join(dirName, v+'.npy')) for v in names if path.exists(path.join(dirName, v+'.npy'))}
+        for v in ['sparseData', 'sparseIndices', 'sparseIndptr', 'sparseShape']:
+            if path.exists(path.join(dirName, v+'.npy')):
+                arrays[v] = np.load(path.join(dirName, v+'.npy'), mmap_mode=mmapMode)
+
+        self.graphFromArrays(info, arrays)
+        self.sparseFromArrays(arrays)
+
+        self.adjMatChanged()
+
+        # use the type the matrix was saved in
+        for mat in [self.adjMat, self.packedAdj, self.sparseAdj]:
+            if not mat is None:
+                self.dtype = mat.dtype
+
+    def graphToArrays(self):
+        '''
+        Convert the graph to a dictionary of information that can be written
+        with json and a dictionary of arrays. Edges are pairs of positions in
+        the node list with a column of weights, xyz values are an Nx3 array and
+        other properties are stored by extraFns.propertyColumns, as a column of
+        values with the positions of the nodes or edges they belong to.
+        '''
+        nodes = self.G.nodes()
+        nodeIndices = dict(zip(nodes, range(len(nodes))))
+        edges = self.G.edges(data=True)
+
+        arrays = {}
+        arrays['edges'] = extraFns.edgePositions(edges, nodeIndices)
+        arrays['weights'] = np.array([e[2].get('weight', np.nan) for e in edges], dtype=float)
+
+        # spatial information
+        arrays['coords'] = np.zeros((len(nodes),3))
+        arrays['coords'][:] = np.nan
+        for n,node in enumerate(nodes):
+            if 'xyz' in self.G.node[node]:
+                arrays['coords'][n] = self.G.node[node]['xyz']
+
+        info = {'nodes':nodes,
+                'directed':self.directed,
+                'threshold':float(self.threshold) if hasattr(self, 'threshold') else None,
+                'nodeProps':[],
+                'edgeProps':[]}
+
+        # node and edge properties as typed columns
+        for mode,dicts,skip in [('node', [self.G.node[v] for v in nodes], ['xyz']),
+                                ('edge', [e[2] for e in edges], ['weight'])]:
+            cols = extraFns.propertyColumns(dicts, skip=skip)
+            for n,prop in enumerate(cols.keys()):
+                info[mode+'Props'].append(prop)
+                arrays[mode+str(n)+'Index'], arrays[mode+str(n)] = cols[prop]
+
+        # properties stored as arrays
+        info['nodeColumns'] = self.nodeProps.keys()
+        for n,prop in enumerate(info['nodeColumns']):
+            arrays.update(columns.columnToArrays(self.nodeProps[prop], 'column'+str(n)))
+        
+        info['edgeColumns'] = self.edgeProps.keys()
+        for n,prop in enumerate(info['edgeColumns']):
+            arrays['edgeColumn'+str(n)+'Keys'] = self.edgeProps[prop][0]
+            arrays.update(columns.columnToArrays(self.edgeProps[prop][1], 'edgeColumn'+str(n)))
+
+        return info, arrays
+
+    def graphFromArrays(self, info, arrays):
+        ''' recreate the graph from the output of graphToArrays '''
+
+        self.directed = info['directed']
+        if self.directed:
+            self.G = nx.DiGraph()
+        else:
+            self.G = nx.Graph()
+
+        if not info['threshold'] is None:
+            self.threshold = info['threshold']
+
+        nodes = info['nodes']
+        self.G.add_nodes_from(nodes)
+
+        edges = arrays['edges']
+        self.G.add_weighted_edges_from(zip([nodes[v] for v in edges[:,0]],
+                                           [nodes[v] for v in edges[:,1]],
+                                           arrays['weights'].tolist()))
+
+        if nodes and all([isinstance(v, (int, long)) and v >= 0 for v in nodes]):
+            coords = np.zeros((max(nodes)+1,3))
+            coords[:] = np.nan
+            coords[nodes] = arrays['coords']
+            self.setCoords(coords)
+        else:
+            for n in np.where(~np.isnan(arrays['coords'][:,0]))[0]:
+                self.G.node[nodes[n]]['xyz'] = tuple(arrays['coords'][n].tolist())
+
+        for n,prop in enumerate(info['nodeProps']):
+            inds = arrays['node'+str(n)+'Index']
+            self.addNodeProperties(str(prop), [nodes[v] for v in inds], arrays['node'+str(n)].tolist())
+
+        for n,prop in enumerate(info['edgeProps']):
+            inds = arrays['edge'+str(n)+'Index']
+            self.addEdgeProperty(str(prop), [(nodes[edges[v,0]], nodes[edges[v,1]]) for v in inds], arrays['edge'+str(n)].tolist())
 
+        self.nodeProps = {}
+        for n,prop in enumerate(info['nodeColumns']):
+            self.nodeProps[str(prop)] = columns.columnFromArrays(arrays, 'column'+str(n))
         
+        self.edgeProps = {}
+        for n,prop in enumerate(info.get('edgeColumns', [])):
+            self.edgeProps[str(prop)] = (arrays['edgeColumn'+str(n)+'Keys'],
+                                         columns.columnFromArrays(arrays, 'edgeColumn'+str(n)))
+
+    def sparseToArrays(self):
+        ''' get the arrays of the sparse adjacency matrix, if there is one, for saving '''
+
+        if self.sparseAdj is None:
+            return {}
+        else:
+            return {'sparseData':self.sparseAdj.data,
+                    'sparseIndices':self.sparseAdj.indices,
+                    'sparseIndptr':self.sparseAdj.indptr,
+                    'sparseShape':np.array(self.sparseAdj.shape)}
+
+    def sparseFromArrays(self, arrays):
+        ''' recreate the sparse adjacency matrix from the output of sparseToArrays '''
+
+        if 'sparseData' in arrays:
+            from scipy import sparse
+            self.sparseAdj = sparse.csr_matrix((arrays['sparseData'], arrays['sparseIndices'], arrays['sparseIndptr']),
+                                               shape=tuple(arrays['sparseShape']))
+        else:
+            self.sparseAdj = None
+
+    def snapshot(self, fname):
+        '''
+        Save the whole state of the brain to a single compressed numpy file so
+        that long runs of degenerate or contiguousspread can be checkpointed and
+        carried on with restore. As well as the adjacency matrix, edges, weights
+        and node properties (including the degenerating flags) this keeps the
+        highlights, riskEdges, dyingEdges and each node's linkedNodes.
+        '''
+        info, arrays = self.graphToArrays()
+        nodes = info['nodes']
+        nodeIndices = dict(zip(nodes, range(len(nodes))))
+
+        if not self.adjMat is None:
+            arrays['adjMat'] = self.adjMat
+        if not self.packedAdj is None:
+            arrays['packedAdj'] = self.packedAdj
+        arrays.update(self.sparseToArrays())
+
+        info['labelNo'] = self.labelNo
+        info['exclnodes'] = getattr(self, 'exclnodes', None)
+
+        # lists of linked nodes, flattened with the number of links for each node (-1 if not set)
+        linked = [self.G.node[v].get('linkedNodes') for v in nodes]
+        arrays['linkedNodesCount'] = np.array([len(l) if not l is None else -1 for l in linked], dtype=int)
+        arrays['linkedNodes'] = np.array([nodeIndices[v] for l in linked if l for v in l], dtype=int)
+
+        # at risk edges
+        info['riskEdges'] = not self.riskEdges is None
+        if self.riskEdges:
+            arrays['riskEdges'] = extraFns.edgePositions(self.riskEdges, nodeIndices)
+        else:
+            arrays['riskEdges'] = np.zeros((0,2), dtype=int)
+
+        # lost edges and their properties
+        dyingEdges = self.dyingEdges.keys()
+        arrays['dyingEdges'] = extraFns.edgePositions(dyingEdges, nodeIndices)
+        cols = extraFns.propertyColumns([self.dyingEdges[e] for e in dyingEdges])
+        info['dyingEdgeProps'] = cols.keys()
+        for n,prop in enumerate(cols.keys()):
+            arrays['dying'+str(n)+'Index'], arrays['dying'+str(n)] = cols[prop]
+
+        # highlights
+        info['highlights'] = []
+        for n,label in enumerate(self.highlights.keys()):
+            h = self.highlights[label]
+            info['highlights'].append({'label':label,
+                                       'colour':h.colour,
+                                       'opacity':h.opacity,
+                                       'edgeOpacity':h.edgeOpacity})
+            arrays['hl'+str(n)+'Nodes'] = np.array([nodeIndices[v] for v in h.nodeIndices], dtype=int)
+            arrays['hl'+str(n)+'Edges'] = extraFns.edgePositions(h.edgeIndices, nodeIndices)
+
+        arrays['info'] = np.array(json.dumps(info))
+        np.savez_compressed(fname, **arrays)
+
+    def restore(self, fname):
+        ''' restore the state of the brain from a file written by snapshot '''
+
+        f = np.load(fname)
+        arrays = {v:f[v] for v in f.files}
+        f.close()
+        info = json.loads(str(arrays['info']))
+
+        if 'adjMat' in arrays:
+            self.adjMat = arrays['adjMat']
+        else:
+            self.adjMat = None
+        self.packedAdj = arrays.get('packedAdj')
+
+        self.graphFromArrays(info, arrays)
+        self.sparseFromArrays(arrays)
+
+        self.adjMatChanged()
+
+        # use the type the matrix was saved in
+        for mat in [self.adjMat, self.packedAdj, self.sparseAdj]:
+            if not mat is None:
+                self.dtype = mat.dtype
+        nodes = info['nodes']
+
+        self.labelNo = info['labelNo']
+        if not info['exclnodes'] is None:
+            self.exclnodes = info['exclnodes']
+
+        # lists of linked nodes
+        linked = arrays['linkedNodes'].tolist()
+        start = 0
+        for n,count in enumerate(arrays['linkedNodesCount']):
+            if count >= 0:
+                self.G.node[nodes[n]]['linkedNodes'] = [nodes[v] for v in linked[start:start+count]]
+                start += count
+
+        # at risk edges
+        if info['riskEdges']:
+            self.riskEdges = [(nodes[v[0]], nodes[v[1]]) for v in arrays['riskEdges']]
+        else:
+            self.riskEdges = None
+
+        # lost edges
+        dyingEdges = [(nodes[v[0]], nodes[v[1]]) for v in arrays['dyingEdges']]
+        self.dyingEdges = {e:{} for e in dyingEdges}
+        for n,prop in enumerate(info['dyingEdgeProps']):
+            vals = arrays['dying'+str(n)].tolist()
+            for m,ind in enumerate(arrays['dying'+str(n)+'Index']):
+                self.dyingEdges[dyingEdges[ind]][str(prop)] = vals[m]
+
+        # highlights
+        self.highlights = {}
+        for n,hlInfo in enumerate(info['highlights']):
+            h = highlightObj()
+            h.colour = tuple(hlInfo['colour'])
+            h.opacity = hlInfo['opacity']
+            h.edgeOpacity = hlInfo['edgeOpacity']
+            h.nodeIndices = [nodes[v] for v in arrays['hl'+str(n)+'Nodes']]
+            h.edgeIndices = [(nodes[v[0]], nodes[v[1]]) for v in arrays['hl'+str(n)+'Edges']]
+            self.highlights[hlInfo['label']] = h
+
+
+    ### copies
+
+    def fork(self):
+        '''
+        Make a copy of the brain that shares its large arrays, e.g. to run many
+        degeneration scenarios from the same thresholded brain. Nothing large
+        is copied up front:
+
+        - the adjacency matrix, packed or sparse matrix, coordinates and property
+          columns are shared, as read only views. Edge changes logged for the
+          matrix (see logEdge), e.g. by degenerate, are kept in the fork's
+          journal rather than written to it (see syncAdjMat), so the fork only
+          holds what it changed. The matrix is copied, with the changes, the
+          first time the fork reads it, e.g. to threshold it again. Until
+          then, changes the original brain makes to its matrix in place are
+          seen by the fork.
+        - the edges are shared as an array graph (see graphCore.csrGraph) and
+          the fork's G is only made from them when it is first used (see
+          setCore). Only the node dictionaries are copied, but once the fork's
+          G is made it holds all the edges, not just those that changed, so
+          running degenerate on a fork costs a full G.
+        - the sorted weight and nearest neighbour indices are shared.
+
+        A fork is an ordinary brainObj, so it can be pickled and passed to
+        worker processes, but pickling copies the shared arrays too. If G has
+        edge attributes other than weight, or nodes that aren't integers, G is
+        copied instead so that they are kept.
+        '''
+        clone = brainObj(directed=self.directed, dtype=self.dtype, core=self.useCore)
+        clone.__dict__.update(self.__dict__)
+        
+        # large arrays are shared but can't be written through the fork, a
+        # matrix this brain only shares is left in sharedAdj (see syncAdjMat)
+        for name in ['adjMat', 'packedAdj', 'sparseAdj']:
+            if not name in self.__dict__:
+                del clone.__dict__[name]
+        for name in ['adjMat', 'packedAdj', 'coords']:
+            if not self.__dict__.get(name) is None:
+                setattr(clone, name, self.readOnly(self.__dict__[name]))
+        if not self.__dict__.get('sparseAdj') is None:
+            from scipy import sparse
+            S = self.sparseAdj
+            clone.sparseAdj = sparse.csr_matrix((self.readOnly(S.data), self.readOnly(S.indices), self.readOnly(S.indptr)), shape=S.shape)
+        clone.nodeProps = dict((p, self.readOnly(c)) for p,c in self.nodeProps.items())
+        clone.edgeProps = dict((p, (self.readOnly(k), self.readOnly(c))) for p,(k,c) in self.edgeProps.items())
+        if not self.neighbourIndex is None:
+            clone.neighbourIndex = tuple(self.readOnly(v) for v in self.neighbourIndex)
+        
+        # the views are new arrays, so the caches need the fork's key
+        if not 'sharedAdj' in self.__dict__:
+            if self.weightIndexKey == self.adjKey():
+                clone.weightIndexKey = clone.adjKey()
+            if self.neighbourIndexKey == self.adjKey():
+                clone.neighbourIndexKey = clone.adjKey()
+        
+        # containers that the fork changes in place are copied
+        clone.edgeJournal = list(self.edgeJournal)
+        clone.highlights = dict((k, deepcopy(h)) for k,h in self.highlights.items())
+        clone.dyingEdges = dict(self.dyingEdges)
+        if not self.riskEdges is None:
+            clone.riskEdges = list(self.riskEdges)
+        
+        # edges, shared as an array graph where possible
+        clone.__dict__.pop('G', None)
+        clone.__dict__.pop('nodeGraph', None)
+        if self.coreCurrent():
+            nodeGraph, clone.core = self.nodeGraph, self.core
+        else:
+            nodeGraph, clone.core = self.G, self.forkCore()
+            if clone.core is None:
+                clone.G = self.G.copy()
+                return clone
+        
+        clone.nodeGraph = nodeGraph.__class__()
+        clone.nodeGraph.add_nodes_from([(n, dict(d)) for n,d in nodeGraph.nodes_iter(data=True)])
+        if not clone.coords is None:
+            # xyz are views of the (read only) coordinates
+            for n,d in clone.nodeGraph.nodes_iter(data=True):
+                if isinstance(d.get('xyz'), np.ndarray) and isinstance(n, (int, long)) and n < len(clone.coords):
+                    d['xyz'] = clone.coords[n]
+        
+        return clone
+        
+    def forkCore(self):
+        ''' the array graph of G's edges shared by forks. G's edges are read
+            every time, so changes made to G directly (e.g. new edge attributes)
+            are never missed, but the array graph is only made again if they
+            differ from the last one. None if the edges have attributes other
+            than weight or the nodes aren't integers, which the array graph
+            can't hold. '''
+        
+        nodes = self.G.nodes()
+        if not all([isinstance(v, (int, long)) and v >= 0 for v in nodes]):
+            return None
+        edges = self.G.edges(data=True)
+        if not all([d.keys() == ['weight'] for a,b,d in edges]):
+            return None
+        
+        nodes = np.sort(np.array(nodes, dtype=int))
+        i = np.array([e[0] for e in edges], dtype=int)
+        j = np.array([e[1] for e in edges], dtype=int)
+        w = np.array([e[2]['weight'] for e in edges], dtype=float)
+        
+        core = self.forkBase
+        if (core is None or core.directed != self.directed or not np.array_equal(core.nodes(), nodes)
+            or not np.array_equal(core.i, i) or not np.array_equal(core.j, j) or not np.array_equal(core.w, w)):
+            nNodes = max(nodes[-1]+1 if len(nodes) else 0, np.max(i)+1 if len(i) else 0, np.max(j)+1 if len(j) else 0)
+            self.forkBase = graphCore.csrGraph(nNodes, i, j, w, directed=self.directed, nodes=nodes)
+        
+        return self.forkBase
+        
+    def readOnly(self, a):
+        ''' a read only view of an array, other objects are returned as they are '''
+        if isinstance(a, columns.categorical):
+            return columns.categorical(codes=self.readOnly(a.codes), categories=self.readOnly(a.categories))
+        if isinstance(a, np.ndarray):
+            a = a.view()
+            a.flags.writeable = False
+        return a
+        
+    def sharesAdjMat(self):
+        ''' True if the adjacency matrix is a read only view shared with the
+            brain this was forked from (see fork) '''
+        if 'sharedAdj' in self.__dict__:
+            return True
+        for a in [self.adjMat, self.packedAdj]:
+            if not a is None and not a.flags.writeable:
+                return True
+        return not self.sparseAdj is None and not self.sparseAdj.data.flags.writeable
+        
+    def ownAdjMat(self):
+        ''' make sure the adjacency matrix can be written, copying it if it is
+            shared with the brain it was forked from (see fork) '''
+        if not self.adjMat is None and not self.adjMat.flags.writeable:
+            self.adjMat = np.array(self.adjMat)
+        if not self.packedAdj is None and not self.packedAdj.flags.writeable:
+            self.packedAdj = np.array(self.packedAdj)
+        if not self.sparseAdj is None and not self.sparseAdj.data.flags.writeable:
+            from scipy import sparse
+            S = self.sparseAdj
+            self.sparseAdj = sparse.csr_matrix((np.array(S.data), S.indices, S.indptr), shape=S.shape)
+
     ### supplementary structures
 
     #!! rename background to template
@@ -338,7 +1392,7 @@ class brainObj:
 
     #!! need to create minimum spanning tree option??
     #!! doPrint option removed in merge
-    def applyThreshold(self, thresholdType = None, value = 0., edgePC = None, totalEdges = None, tVal = None, rethreshold=False):
+    def applyThreshold(self, thresholdType = None, value = 0., edgePC = None, totalEdges = None, tVal = None, rethreshold=False, blockSize=None):
         ''' Treshold the adjacency matrix to determine which nodes are linked by edges. There are 
             four options:
             
@@ -347,14 +1401,25 @@ class brainObj:
             tVal - give a value for the threshold at which edges are chosen 
             no threshold - in which case all possible edges are created
             
-            rethreshold can be used if the threshold has already been applied --- NOT CURRENTLY A LIVE OPTION'''
+            rethreshold can be used if the threshold has already been applied, then
+            only the edges that change are added to or removed from G (see setEdges)
+            
+            For matrices too big for memory, e.g. a memmap adjMat, blockSize reads
+            that many rows of the matrix at a time, so the memory needed depends on
+            the number of edges kept rather than the size of the matrix
+            (see blockThreshold).'''
 
         #### legacy case
         if not(thresholdType):
 
             #### Determine threshold value
-            weights = self.adjMat.flatten()
-            self.threshold = np.min(np.ma.array(weights, mask=np.isnan(weights), dtype="float64"))
+            if blockSize and not self.adjMat is None:
+                self.threshold = np.min([np.min(w) for i,j,w in self.adjBlocks(blockSize) if len(w)])
+            elif self.adjMat is None:
+                self.threshold = np.min(self.edgeWeights())
+            else:
+                # mask the NaNs in place rather than copying the matrix
+                self.threshold = np.min(np.ma.array(self.adjMat, mask=np.isnan(self.adjMat)))
 
 # I think these lines can be safely removed. Seemed to be some sort of merger conflict.
 #        #### legacy case
@@ -447,46 +1512,15 @@ class brainObj:
                 
             # case where % of edges to display is given
             elif thresholdType in ['edgePC', 'totalEdges']:
-                if not self.directed:
-                    # only flatten the upper right part of the matrix
-                    weights = np.array(extraFns.undirectedFlatten(self.adjMat))
-                else:
-                    weights = np.array(self.adjMat.flatten())
-                
-                # remove NaNs
-                weights = weights[~np.isnan(weights)]
-                
-                # sort in to ascending orders
-                weights.sort()
-                
-                # get number of edges
-                nEdges = len(weights)
-                    
                 # percentage case
                 if thresholdType == 'edgePC':
                     print('edgePC')
-                    # get number of edges
-                    edgeNum = int( (value/100.) * nEdges)
+                    self.threshold, edgeNum = self.edgeThreshold(edgePC=value, blockSize=blockSize)
                     
                 # number of edges case
                 elif thresholdType == 'totalEdges':
                     print('num edges case')
-                    edgeNum = value
-                    
-                # make sure it's an integer
-                edgeNum = int(edgeNum)
-                                    
-                # get threshold value
-                if edgeNum > len(weights):
-                    # case where all edges are included
-                    self.threshold = weights[0]
-                elif edgeNum <=0:
-                    # case where number of edges is 0 or less
-                    self.threshold = weights[-1]+0.5
-                else:
-                    # case where some edges are included
-                    print weights
-                    self.threshold = weights[-edgeNum]
+                    self.threshold, edgeNum = self.edgeThreshold(edgeNum=value, blockSize=blockSize)
                 
                 print("edgeNum and threshold", edgeNum, self.threshold)
 
@@ -499,83 +1533,449 @@ class brainObj:
 #        print self.threshold
 #>>>>>>> c1d674adc1d01f9228645e61088eeb378487e236
             
-        ##### carry out thresholding on adjacency matrix (new and legacy)
-        boolMat = self.adjMat>=self.threshold
-        try:
+        ##### carry out thresholding and add the edges to networkx
+        i, j, w = self.thresholdEdges(blockSize=blockSize)
+        self.setEdges(i, j, w, rethreshold=rethreshold)
+
+    def thresholdEdges(self, threshold=None, blockSize=None):
+        ''' get the edges with weights of at least threshold (self.threshold by default)
+            as arrays of start nodes, end nodes and weights. Undirected edges are
+            taken once, from the upper triangle of the adjacency matrix. If
+            blockSize is given, the full adjacency matrix is read in blocks of
+            that many rows (see adjBlocks). '''
+        
+        if threshold is None:
+            threshold = self.threshold
+            
+        # full adjacency matrix, block by block
+        if blockSize and not self.adjMat is None:
+            edges = [(i[w>=threshold], j[w>=threshold], w[w>=threshold]) for i,j,w in self.adjBlocks(blockSize)]
+            if not edges:
+                return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=self.dtype)
+            return tuple(np.concatenate(v) for v in zip(*edges))
+            
+        # sparse adjacency matrix
+        if self.adjMat is None and not self.sparseAdj is None:
+            from scipy import sparse
+            if self.directed:
+                S = self.sparseAdj.tocoo()
+            else:
+                S = sparse.triu(self.sparseAdj, k=1).tocoo()
+            keep = (S.data >= threshold) & (S.row != S.col)
+            return S.row[keep], S.col[keep], S.data[keep]
+            
+        # packed upper triangle
+        if self.adjMat is None and not self.packedAdj is None:
+            k = np.where(self.packedAdj >= threshold)[0]
+            i, j = extraFns.unpackIndex(k, extraFns.packedSize(self.packedAdj))
+            return i, j, self.packedAdj[k]
+            
+        # full adjacency matrix
+        boolMat = self.adjMat >= threshold
+        if self.directed:
             np.fill_diagonal(boolMat, 0)
-        except:
-            for x in range(len(boolMat[0,:])):
-                boolMat[x,x] = 0
-                
-        es = np.where(boolMat) # lists of where edges should be
-
-        # exclude duplicates if not directed 
-        if not(self.directed):
-            newes1 = []
-            newes2 = []
-            for ii in range(len(es[1])):
-                if es[0][ii]<es[1][ii]:
-                    newes1.append(es[0][ii])
-                    newes2.append(es[1][ii])
-                    
-            es = (newes1, newes2)                   
-        # add edges to networkx
+        else:
+            boolMat = np.triu(boolMat, 1)
+        i, j = np.where(boolMat)
+        
+        return i, j, self.adjMat[i,j]
+        
+    def setEdges(self, i, j, w, rethreshold=False):
+        ''' replace the edges of G with edges from arrays of start nodes, end nodes
+            and weights, all added in one go.
+            
+            If rethreshold is True only the edges that differ are removed or
+            added, so edges that are kept also keep their attributes. Their
+            weights are updated to w.
+
+            If the brain was made with core=True the edges are put in the array
+            graph instead (see setCore), unless rethreshold is True and G has
+            been made, as the array graph can't keep edge attributes. '''
+
+        self.graphChanged()
+        if self.useCore and not (rethreshold and 'G' in self.__dict__):
+            self.setCore(i, j, w)
+            return
 
-        # could improve the next few lines by spotting when you're only adding edges            
+        if not rethreshold:
+            self.G.remove_edges_from(self.G.edges())
+            self.G.add_weighted_edges_from(zip(i.tolist(), j.tolist(), w.tolist()))
+            return
         
-        # remove previous edges
-        self.G.remove_edges_from(self.G.edges())
-        # add new edges
-        for ii in range(len(es[0])):
-            self.G.add_edge(es[0][ii],es[1][ii], weight = self.adjMat[es[0][ii],es[1][ii]])
+        old = self.G.edges()
+        if all([isinstance(v, (int, long)) and v >= 0 for v in self.G.nodes_iter()]):
+            # give each edge a single integer key to compare the old and new edges
+            old = np.array(old, dtype=int).reshape((-1,2))
+            oldKeys = extraFns.edgeKeys(old[:,0], old[:,1], self.directed)
+            newKeys = extraFns.edgeKeys(i, j, self.directed)
+            lost = old[~np.in1d(oldKeys, newKeys)].tolist()
+        else:
+            # nodes that aren't integers can't be edges from the matrix
+            new = set(zip(i.tolist(), j.tolist()))
+            if not self.directed:
+                new.update(zip(j.tolist(), i.tolist()))
+            lost = [e for e in old if not e in new]
+        
+        # kept edges are updated in place, keeping their other attributes
+        self.G.remove_edges_from(lost)
+        self.G.add_weighted_edges_from(zip(i.tolist(), j.tolist(), w.tolist()))
+
+    def setCore(self, i, j, w):
+        '''
+        replace the edges with those from arrays of start nodes, end nodes and
+        weights, kept as an array graph in self.core.
+
+        The array graph is then the source of truth for the edges and G is only
+        made from it when G is next used. G keeps its nodes and their
+        properties, but edges and edge properties that G had are lost. Once G
+        has been made, it is the source of truth again and graphCore makes a
+        new array graph from it.
+        '''
+        if 'G' in self.__dict__:
+            G = self.__dict__.pop('G')
+            G.remove_edges_from(G.edges())
+            self.nodeGraph = G # G without edges, see __getattr__
+
+        nodes = self.nodeGraph.nodes()
+        nNodes = max(np.max(nodes)+1 if nodes else 0, np.max(i)+1 if len(i) else 0, np.max(j)+1 if len(j) else 0)
+        self.core = graphCore.csrGraph(nNodes, i, j, w, directed=self.directed, nodes=nodes)
+
+    def coreCurrent(self):
+        ''' True if the array graph holds the edges and G has not been made from it yet '''
+        return not self.core is None and not 'G' in self.__dict__
+
+    def graphCore(self):
+        '''
+        the edges as an array graph, see graphCore.csrGraph. This is self.core
+        if G has not been used since it was made, otherwise it is made from G.
+        '''
+        if self.coreCurrent():
+            return self.core
+        return graphCore.fromGraph(self.G)
+
+    def pathLengths(self, weight=None):
+        '''
+        All pairs shortest path lengths, as a list of the nodes and a matrix of
+        the path lengths between them (see extraFns.pathLengths). These are
+        kept until the edges or their properties change, so that several
+        efficiency measures can share them, e.g.:
 
+        paths = brain.pathLengths()
+        extraFns.globalefficiency(brain.G, paths=paths)
+        extraFns.nodalefficiency(brain.G, paths=paths)
+
+        Call graphChanged after setting edge properties in G directly.
+        '''
+        if self.coreCurrent():
+            key = (self.graphVersion, id(self.core), self.core.numberOfEdges(), weight)
+        else:
+            key = (self.graphVersion, id(self.G), self.G.number_of_edges(), weight)
+
+        if self.pathIndexKey != key:
+            if self.coreCurrent() and weight in [None, 'weight']:
+                nodes = self.core.nodes()
+                D = self.core.distances(weighted=bool(weight))
+                self.pathIndex = (nodes.tolist(), D[np.ix_(nodes, nodes)])
+            else:
+                self.pathIndex = extraFns.pathLengths(self.G, weight=weight)
+            self.pathIndexKey = key
+
+        return self.pathIndex
+
+    def sortedEdges(self):
+        ''' get all possible edges (those with weights that aren't NaN) as arrays
+            of start nodes, end nodes and weights, in decreasing order of weight '''
+        
+        i, j, w = self.thresholdEdges(threshold=-np.inf)
+        order = np.argsort(-w, kind='mergesort')
+        
+        return i[order], j[order], w[order]
+        
+    def thresholdSweep(self, densities):
+        ''' generator for thresholding at a series of densities, each a percentage
+            of the possible edges as for edgePC in applyThreshold. For each density,
+            in increasing order, the density and G thresholded at that density are
+            given, e.g.:
+                
+            for pc, G in brain.thresholdSweep(range(1, 31)):
+                print pc, len(G.edges())
+                
+            The edges are sorted once and added to G in decreasing order of weight,
+            so the whole sweep costs little more than thresholding at the highest
+            density. The threshold for each density is found by edgeThreshold, as
+            in applyThreshold, so the possible edges it is a percentage of are
+            those of edgeWeights. G is changed in place, so copy it to keep a
+            graph. '''
+        
+        i, j, w = self.sortedEdges()
+        
+        self.G.remove_edges_from(self.G.edges())
+        self.graphChanged()
+        added = 0
+        for pc in sorted(densities):
+            self.threshold, edgeNum = self.edgeThreshold(edgePC=pc)
+            
+            # the edges are sorted, so those kept are the first n
+            n = np.searchsorted(-w, -self.threshold, side='right')
+            
+            if n > added:
+                self.G.add_weighted_edges_from(zip(i[added:n].tolist(), j[added:n].tolist(), w[added:n].tolist()))
+                added = n
+                self.graphChanged()
+                
+            yield pc, self.G
+            
+    def sweepMetrics(self, densities, metrics):
+        ''' get graph measures at a series of densities (see thresholdSweep).
+            metrics is a dictionary of functions that take a graph and return a
+            single value, e.g. {'efficiency':extraFns.globalefficiency}.
+            
+            Returns a numpy record array with a row for each density, with the
+            density in the 'density' field and each measure in a field named by its
+            key. The area under the curve of a measure is then e.g.:
+                
+            np.trapz(table['efficiency'], table['density']) '''
+        
+        names = sorted(metrics.keys())
+        table = np.zeros(len(densities), dtype=[('density', float)] + [(str(v), float) for v in names])
+        
+        for n,(pc,G) in enumerate(self.thresholdSweep(densities)):
+            table['density'][n] = pc
+            for v in names:
+                table[str(v)][n] = metrics[v](G)
+                
+        return table.view(np.recarray)
+        
     def reconstructAdjMat(self):
-        ''' redefine the adjacency matrix from the edges and weights '''
-        s = self.adjMat.shape
-        self.adjMat = np.zeros(s)
-        self.adjMat[:] = np.nan        
+        ''' redefine the adjacency matrix from the edges and weights, all edges
+            not in G are NaN '''
+        self.adjMatChanged()
+        
+        edges = self.G.edges(data=True)
+        i = np.array([e[0] for e in edges], dtype=int)
+        j = np.array([e[1] for e in edges], dtype=int)
+        w = np.array([e[2].get('weight', np.nan) for e in edges], dtype=self.dtype)
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            # the stored entries are kept as NaN, so edges of G that were in the
+            # matrix are written in place (see setAdjValues)
+            if self.sparseAdj.data.flags.writeable:
+                self.sparseAdj.data[:] = np.nan
+            else:
+                # shared with the brain this was forked from, don't copy values that are replaced
+                from scipy import sparse
+                S = self.sparseAdj
+                data = np.empty(len(S.data), dtype=self.dtype)
+                data[:] = np.nan
+                self.sparseAdj = sparse.csr_matrix((data, S.indices, S.indptr), shape=S.shape)
+        
+        elif self.adjMat is None and not self.packedAdj is None:
+            if self.packedAdj.flags.writeable:
+                self.packedAdj[:] = np.nan
+            else:
+                self.packedAdj = np.empty(len(self.packedAdj), dtype=self.packedAdj.dtype)
+                self.packedAdj[:] = np.nan
+            
+        else:
+            s = self.adjMat.shape
+            self.adjMat = np.empty(s, dtype=self.dtype)
+            self.adjMat[:] = np.nan        
         
-        for e in self.G.edges():
-            self.updateAdjMat(e)
+        self.setAdjValues(i, j, w)
                 
     def updateAdjMat(self, edge):
-        ''' update the adjacency matrix for a single edge '''
+        ''' update the adjacency matrix for a single edge, see logEdge '''
+        self.logEdge(edge)
+        self.syncAdjMat()
+        
+    def logEdge(self, edge, weight=None):
+        ''' record a change to an edge of G in the journal, so that syncAdjMat
+            can apply it to the adjacency matrix. weight is the new weight of the
+            edge, by default its weight in G, or NaN if it is no longer in G or
+            has no weight. '''
+        
+        if weight is None:
+            if self.G.has_edge(edge[0], edge[1]):
+                weight = self.G.edge[edge[0]][edge[1]].get('weight', np.nan)
+            else:
+                weight = np.nan
         
-        try:
-            w = self.G.edge[edge[0]][edge[1]]['weight']
-            self.adjMat[edge[0], edge[1]] = w
-            self.adjMat[edge[1], edge[0]] = w
-        except:
-#            print("no weight found for edge " + str(edge[0]) + " " + str(edge[1]) + ", skipped" )
-            self.adjMat[edge[0], edge[1]] = np.nan
-            self.adjMat[edge[1], edge[0]] = np.nan
+        self.edgeJournal.append((edge[0], edge[1], weight))
+        self.graphChanged()
+        
+    def syncAdjMat(self, deferShared=True):
+        ''' apply the edge changes in the journal (see logEdge) to the adjacency
+            matrix in one go, the last change to each edge being the one kept.
+            
+            Only the changed weights are written, and the sorted weight index and
+            nearest neighbours, if they were made for the matrix before the
+            changes, are updated for just those weights rather than being made
+            again.
             
+            If the matrix is shared with the brain this was forked from, the
+            changes stay in the journal unless deferShared is False, so that the
+            fork only holds what it changed. They are applied, copying the
+            matrix, when it is next used (see __getattr__). '''
+        
+        if not self.edgeJournal:
+            return
+        
+        if deferShared and self.sharesAdjMat():
+            if not 'sharedAdj' in self.__dict__:
+                self.sharedAdj = tuple(self.__dict__.pop(n) for n in ['adjMat', 'packedAdj', 'sparseAdj'])
+            return
+        
+        i = np.array([e[0] for e in self.edgeJournal], dtype=int)
+        j = np.array([e[1] for e in self.edgeJournal], dtype=int)
+        w = np.array([e[2] for e in self.edgeJournal], dtype=self.dtype)
+        self.edgeJournal = []
+        
+        # the diagonal is never an edge, undirected edges are kept in the upper triangle
+        offDiag = i != j
+        i, j, w = i[offDiag], j[offDiag], w[offDiag]
+        if not self.directed:
+            i, j = np.minimum(i, j), np.maximum(i, j)
+        
+        # take the last change to each edge
+        keys = i * (np.max(j)+1 if len(j) else 1) + j
+        keys, last = np.unique(keys[::-1], return_index=True)
+        last = len(i) - 1 - last
+        i, j, w = i[last], j[last], w[last]
+        
+        key = self.adjKey()
+        weightsCurrent = self.weightIndexKey == key and not self.weightIndex is None
+        nbrsCurrent = self.neighbourIndexKey == key and not self.neighbourIndex is None
+        
+        old = self.adjValues(i, j)
+        self.setAdjValues(i, j, w)
+        self.adjVersion += 1
+        key = self.adjKey()
+        
+        if weightsCurrent:
+            # take out the old weights, one of each, and put in the new ones in order
+            old = np.sort(old[~np.isnan(old)])
+            pos = np.searchsorted(self.weightIndex, old, side='left')
+            pos += np.arange(len(old)) - np.searchsorted(old, old, side='left')
+            index = np.delete(self.weightIndex, pos)
+            new = np.sort(w[~np.isnan(w)])
+            self.weightIndex = np.insert(index, np.searchsorted(index, new), new)
+            self.weightIndexKey = key
+        else:
+            self.weightIndex = None
+        
+        if nbrsCurrent:
+            # only the rows of the changed edges need their neighbours finding again
+            nbrs, weights = self.neighbourIndex
+            if not nbrs.flags.writeable:
+                # shared with the brain this was forked from
+                nbrs, weights = np.array(nbrs), np.array(weights)
+                self.neighbourIndex = (nbrs, weights)
+            rows = np.unique(i) if self.directed else np.unique(np.concatenate((i, j)))
+            nbrs[rows], weights[rows] = self.neighbourRows(self.adjMat, rows, nbrs.shape[1])
+            self.neighbourIndexKey = key
+        else:
+            self.neighbourIndex = None
+        
+    def adjValues(self, i, j):
+        ''' get the weights of the edges from arrays of start and end nodes, NaN
+            where there isn't a possible edge. For undirected brains i must be less
+            than j. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            # entries not stored in the sparse matrix aren't possible edges
+            pos = self.sparsePositions(i, j)
+            vals = np.empty(len(pos), dtype=self.dtype)
+            vals[:] = np.nan
+            vals[pos >= 0] = self.sparseAdj.data[pos[pos >= 0]]
+            return vals
+        
+        elif self.adjMat is None and not self.packedAdj is None:
+            return np.array(self.packedAdj[extraFns.packIndex(i, j, extraFns.packedSize(self.packedAdj))])
+        
+        return np.array(self.adjMat[i, j])
+        
+    def setAdjValues(self, i, j, w):
+        ''' set the weights of the edges from arrays of start nodes, end nodes and
+            weights, in both directions for undirected brains. NaN weights are
+            lost edges. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            if not self.directed:
+                i, j, w = np.concatenate((i, j)), np.concatenate((j, i)), np.concatenate((w, w))
+            
+            # entries already stored are written in place
+            self.ownAdjMat()
+            pos = self.sparsePositions(i, j)
+            self.sparseAdj.data[pos[pos >= 0]] = w[pos >= 0]
+            
+            # new entries change the structure of the matrix, so are added in one go
+            new = (pos < 0) & ~np.isnan(w)
+            if np.any(new):
+                from scipy import sparse
+                S = self.sparseAdj.tocoo()
+                self.sparseAdj = sparse.csr_matrix((np.concatenate((S.data, w[new])),
+                                                    (np.concatenate((S.row, i[new])), np.concatenate((S.col, j[new])))),
+                                                   shape=S.shape)
+        
+        elif self.adjMat is None and not self.packedAdj is None:
+            self.ownAdjMat()
+            offDiag = i != j
+            self.packedAdj[extraFns.packIndex(i[offDiag], j[offDiag], extraFns.packedSize(self.packedAdj))] = w[offDiag]
+            
+        else:
+            self.ownAdjMat()
+            self.adjMat[i, j] = w
+            if not self.directed:
+                self.adjMat[j, i] = w
+
+    def sparsePositions(self, i, j):
+        ''' get the positions in the data of the sparse adjacency matrix of the
+            entries from arrays of start and end nodes, -1 where there isn't a
+            stored entry. Each entry is a binary search of its row, so only the
+            rows of the edges are read. '''
+        
+        if not self.sparseAdj.has_sorted_indices:
+            self.sparseAdj = self.sparseAdj.sorted_indices()
+        indptr, indices = self.sparseAdj.indptr, self.sparseAdj.indices
+        
+        pos = np.zeros(len(i), dtype=int) - 1
+        for k,(a,b) in enumerate(zip(np.asarray(i).tolist(), np.asarray(j).tolist())):
+            start, end = indptr[a], indptr[a+1]
+            p = start + np.searchsorted(indices[start:end], b)
+            if p < end and indices[p] == b:
+                pos[k] = p
+        
+        return pos
 
     #!! added from master is this in the right place?? 
     def localThresholding(self, totalEdges=None, edgePC=None, removeUnconnected=True):
         '''
         Threshold the association matrix by building from the minimum spanning
         tree and adding successive N-nearest neighbour degree graphs.        
+        
+        The edges replace those of G (see setEdges). They and their weights are
+        taken from the adjacency matrix, so it is left as it is, as for
+        applyThreshold.
         '''
-        self.applyThreshold()
+        self.getAdjMat()
         if removeUnconnected:
-            self.removeUnconnectedNodes()
+            # remove nodes without any possible edges
+            notNaN = ~np.isnan(self.adjMat)
+            linked = (np.sum(notNaN, axis=0) + np.sum(notNaN, axis=1) - 2*np.diagonal(notNaN)) > 0
+            self.G.remove_nodes_from([v for v in self.G.nodes() if not linked[v]])
+            del(notNaN)
         # get the number of edges to link
         if not edgePC == None:  # needs to be written this way in case edgePC is 0
             # find threshold as a percentage of total possible edges
             # note this works for undirected graphs because it is applied to the whole adjacency matrix
-            weights = self.adjMat.flatten()
-            weights.sort()
-            while (str(weights[-1]) == 'nan'):
-                weights = weights[:-1]
-            nEdges = len(weights)
+            nEdges = np.sum(~np.isnan(self.adjMat))
             
             # note this works for undirected graphs because it is applied to the whole adjacency matrix
             edgeNum = int(edgePC/100. * nEdges)
                 
             # correct for diagonal if graph is undirected
             if not self.directed:
-                edgeNum -= len([self.adjMat[x,x] for x in range(len(self.adjMat[0,:])) if not np.isnan(self.adjMat[x,x])])
+                edgeNum -= np.sum(~np.isnan(np.diagonal(self.adjMat)))
             print edgeNum
 
             self.edgePC=edgePC
@@ -588,45 +1988,45 @@ class brainObj:
 
         k=1 # number of degrees for NNG
     
-        # create minimum spanning tree
-        T = self.minimum_spanning_tree(self)
-        lenEdges = len(T.edges())
+        # create the spanning tree of the strongest edges from the adjacency matrix
+        I, J, W = self.spanningTree()
+        I, J = np.minimum(I, J), np.maximum(I, J)
+        lenEdges = len(W)
         if lenEdges > edgeNum:
             print "The minimum spanning tree already has: "+ str(lenEdges) + " edges, select more edges."
         
-        while lenEdges<edgeNum:
+        # the nearest neighbour graph of degree k adds the kth nearest neighbour
+        # of each node to that of degree k-1, so the graph is grown a layer at a time
+        n = len(self.adjMat)
+        while lenEdges<edgeNum and k<n:
             print "NNG degree: "+str(k)
-            # create nearest neighbour graph
-            nng = self.NNG(k)
+            # kth nearest neighbours of all the nodes
+            nbrs, weights = self.nearestNeighbours(k)
+            i, j, w = np.arange(n), nbrs[:,k-1], weights[:,k-1]
+            valid = ~np.isnan(w)
             
             # failsafe in case there are no more edges to add
-            if len(nng.edges())==0:
+            if not np.any(valid):
                 print "There are no edges in the nearest neighbour graph - check you have set the delimiter appropriately"
                 break
             
-            # remove edges from the NNG that exist already in the new graph/MST
-            nng.remove_edges_from(T.edges())
+            # take each edge once
+            i, j, w = np.minimum(i[valid], j[valid]), np.maximum(i[valid], j[valid]), w[valid]
+            keys, first = np.unique(i*n + j, return_index=True)
+            i, j, w = i[first], j[first], w[first]
             
-            # add weights to NNG
-            for e in nng.edges():
-                nng.edge[e[0]][e[1]]['weight'] = self.adjMat[e[0],e[1]]
-            
-            nng.edges(data=True)
-            
-            # get a list of edges from the NNG in order of weight
-            edgeList = sorted(nng.edges(data=True), key=lambda t: t[2]['weight'], reverse=True)
+            # leave out edges that exist already in the new graph/MST
+            new = ~np.in1d(keys, I*n + J)
+            i, j, w = i[new], j[new], w[new]
             
             # add edges to graph in order of connectivity strength
-            for edge in edgeList:
-                T.add_edges_from([edge])
-                lenEdges = len(T.edges())
-                if lenEdges >= edgeNum:
-                    break
+            order = np.argsort(-w, kind='mergesort')[:edgeNum-lenEdges]
+            I, J, W = np.concatenate((I, i[order])), np.concatenate((J, j[order])), np.concatenate((W, w[order]))
+            lenEdges = len(W)
             
             k+=1
         
-        #!! are you sure you want to redefine G here??
-        self.G = T
+        self.setEdges(I, J, W)
         
         
     def binarise(self):
@@ -635,6 +2035,7 @@ class brainObj:
         '''
         for edge in self.G.edges():
             self.G.edge[edge[0]][edge[1]]['weight'] = 1        
+        self.graphChanged()
 
     def removeUnconnectedNodes(self):
         '''
@@ -642,6 +2043,7 @@ class brainObj:
         '''
         nodeList = [v for v in self.G.nodes() if self.G.degree(v)==0]
         self.G.remove_nodes_from(nodeList)
+        self.graphChanged()
 
     ### making highlights
 
@@ -677,14 +2079,21 @@ class brainObj:
         h.edgeIndices = []
         h.nodeIndices = []
         
-        print(prop, rel, val, label, mode)
-        
         # extract lists from edges  
         if mode in ['edge', 'node or edge']:
+            edges = self.G.edges(data = True)
+            
+            # compare properties stored as arrays all at once
+            d = self.edgePropertyArray(prop, [e[:2] for e in edges])
+            if not d is None and rel != 'contains':
+                vals, has = d
+                boolvals = has & self.propCompare(vals, rel, val)
+                h.edgeIndices = [(e[0],e[1]) for e,b in zip(edges, boolvals) if b]
+                edges = []
+            
             ind = -1
-            for e in self.G.edges(data = True):
+            for e in edges:
                 ind = ind +1
-                print(self.G.edge[e[0]][e[1]])
                 try:
                     d = self.G.edge[e[0]][e[1]][prop]
                 except KeyError:
@@ -692,7 +2101,6 @@ class brainObj:
                 
                 # match properties
                 boolval = self.propCompare(d, rel, val)
-                print(d, rel, val, boolval)
                 
                 # save data in highlight
                 if boolval:
@@ -701,7 +2109,17 @@ class brainObj:
         
         # extract lists from nodes
         if mode in ['node', 'node or edge']:
-            for c in range(len(self.G.nodes())):
+            nodes = self.G.nodes()
+            
+            # compare properties stored as arrays all at once
+            d = self.nodePropertyArray(prop, nodes)
+            if not d is None and rel != 'contains':
+                vals, has = d
+                boolvals = has & self.propCompare(vals, rel, val)
+                h.nodeIndices = [v for v,b in zip(nodes, boolvals) if b]
+                nodes = []
+                
+            for c in nodes:
                 # get property
 
                 # special treatment for 'x', 'y' and 'z'
@@ -833,8 +2251,8 @@ class brainObj:
             pcLimit = self.thresholdToPercentage(threshLimit)
         
         if pcLimit:
-            lenNodes = len(self.G.nodes())
-            lenEdges = len(self.G.edges())
+            lenNodes = self.G.number_of_nodes()
+            lenEdges = self.G.number_of_edges()
             
             maxEdges = float(lenNodes * (lenNodes-1))
             if not self.G.is_directed():
@@ -912,9 +2330,11 @@ class brainObj:
                 self.dyingEdges[dyingEdge] = self.G[dyingEdge[0]][dyingEdge[1]]
                 self.dyingEdges[dyingEdge]['distance'] =  np.linalg.norm( np.array((self.G.node[dyingEdge[0]]['xyz'])) - np.array((self.G.node[dyingEdge[1]]['xyz']))  )
             
-            # update the adjacency matrix (essential if robustness is to be calculated)            
+            # record the change for the adjacency matrix (essential if robustness is to be calculated)            
             if updateAdjmat:
-                self.updateAdjMat(dyingEdge)
+                self.logEdge(dyingEdge)
+            else:
+                self.graphChanged()
                             
             # add nodes to toxic list if the spread option is selected
             if spread:
@@ -930,7 +2350,8 @@ class brainObj:
                 self.riskEdges = nx.edges(self.G, nodeList)        
         
         ## Update adjacency matrix to reflect changes
-        #self.reconstructAdjMat()
+        if updateAdjmat:
+            self.syncAdjMat()
         
         print "Number of toxic nodes: "+str(len(nodeList))
         
@@ -1020,7 +2441,7 @@ class brainObj:
 #            print(toxicNodes)
             
         # Update adjacency matrix to reflect changes
-        self.reconstructAdjMat()
+        self.syncAdjMat()
             
         return toxicNodes, toxicNodeRecord              
             
@@ -1034,6 +2455,7 @@ class brainObj:
         try:
             edges_to_remove = random.sample(self.G.edges(), edgeloss)
             self.G.remove_edges_from(edges_to_remove)
+            self.graphChanged()
             
         except ValueError:
             print "No further edges left"
@@ -1045,6 +2467,7 @@ class brainObj:
     #!! added direct from master branch        
     def randomiseGraph(self, largestconnectedcomp = False):
         self.G = nx.gnm_random_graph(len(self.G.nodes()), len(self.G.edges()))
+        self.graphChanged()
         if largestconnectedcomp:
             self.bigconnG = components.connected.connected_component_subgraphs(self.G)[0]  # identify largest connected component
 
@@ -1058,29 +2481,127 @@ class brainObj:
     ### Minimum spanning tree functions
 
     #!! This and following functions added during merge. Need explanation.
+    def nearestNeighbours(self, k, blockSize=1000):
+        ''' get the k nearest neighbours of every node, the nodes it has the
+            strongest connections to. Returns an N x k array with the neighbours of
+            each node in decreasing order of weight, and an array of their
+            weights. Where a node has fewer than k neighbours the weights are NaN.
+            
+            Each row of the adjacency matrix is partially sorted, blockSize rows at
+            a time, and the order is kept until the matrix changes. More
+            neighbours than asked for are sorted, so that growing k only sorts the
+            rows again a few times. '''
+        
+        adjMat = self.getAdjMat()
+        n = len(adjMat)
+        k = min(k, n-1)
+        
+        if self.neighbourIndex is None or self.neighbourIndexKey != self.adjKey() or self.neighbourIndex[0].shape[1] < k:
+            if self.neighbourIndex is None or self.neighbourIndexKey != self.adjKey():
+                K = k
+            else:
+                K = max(k, 2*self.neighbourIndex[0].shape[1])
+            K = min(K, n-1)
+            
+            nbrs = np.zeros((n, K), dtype=int)
+            weights = np.zeros((n, K), dtype=self.dtype)
+            for start in range(0, n, blockSize):
+                rows = np.arange(start, min(start+blockSize, n))
+                nbrs[rows], weights[rows] = self.neighbourRows(adjMat, rows, K)
+                
+            self.neighbourIndex = (nbrs, weights)
+            self.neighbourIndexKey = self.adjKey()
+        
+        nbrs, weights = self.neighbourIndex
+        return nbrs[:,:k], weights[:,:k]
+
+    def neighbourRows(self, adjMat, rows, K):
+        ''' get the K nearest neighbours, and their weights, of the nodes in rows
+            of adjMat, as for nearestNeighbours '''
+        
+        # negative weights so that the strongest come first, NaNs and the diagonal last
+        W = -np.array(adjMat[rows], dtype=self.dtype)
+        r = np.arange(len(W))
+        W[np.isnan(W)] = np.inf
+        W[r, rows] = np.inf
+        
+        # find the K strongest of each row, then sort just those
+        part = np.argpartition(W, K-1, axis=1)[:,:K]
+        order = np.argsort(W[r[:,np.newaxis], part], axis=1, kind='mergesort')
+        nbrs = part[r[:,np.newaxis], order]
+        weights = -W[r[:,np.newaxis], nbrs]
+        weights[np.isinf(weights)] = np.nan
+        
+        return nbrs, weights
+
     def NNG(self, k):
-        ''' '''
-        #!! docstring missing
+        ''' create the nearest neighbour graph of degree k, with an edge from each
+            node to its k nearest neighbours (see nearestNeighbours) '''
         G = nx.Graph()
-        nodes = range(len(self.adjMat[0]))
+        nbrs, weights = self.nearestNeighbours(k)
+        n = len(nbrs)
         
-        G.add_nodes_from(nodes)
+        G.add_nodes_from(range(n))
         
-        for i in nodes:
-            l = np.ma.masked_array(self.adjMat[i,:], mask=np.isnan(self.adjMat[i]))
-            l.mask[i] = True
-            
-            for j in range(k):
-                node = np.argmax(l)
-                
-                if not np.isnan(self.adjMat[i,node]):
-                    G.add_edge(i,node)
-                    
-                l.mask[node] = True
+        i = np.repeat(np.arange(n), nbrs.shape[1])
+        j, w = nbrs.flatten(), weights.flatten()
+        valid = ~np.isnan(w)
+        G.add_weighted_edges_from(zip(i[valid].tolist(), j[valid].tolist(), w[valid].tolist()))
         
         return(G)
 
 
+    def spanningTree(self, minimum=False, makeGraph=False):
+        ''' Find the spanning tree of the nodes in G with the strongest edges (or
+        the weakest if minimum is True) straight from the adjacency matrix, so
+        G doesn't need to hold every possible edge. NaNs are not edges, and if
+        the nodes are not all connected a spanning forest is found.
+        
+        Uses Prim's algorithm, taking a row of the matrix at a time (see adjRow).
+        Returns arrays of the start nodes, end nodes and weights of the edges of
+        the tree. If makeGraph is True, the edges of G are replaced by the tree.
+        '''
+        if self.directed:
+            raise nx.NetworkXError("Spanning tree not defined for directed graphs.")
+            
+        if self.adjMat is None and not self.sparseAdj is None:
+            n = self.sparseAdj.shape[0]
+        elif self.adjMat is None and not self.packedAdj is None:
+            n = extraFns.packedSize(self.packedAdj)
+        else:
+            n = len(self.adjMat)
+        sign = -1. if minimum else 1.
+        
+        # nodes not in G are never added, nodes in the tree have NaN as their best weight
+        best = np.empty(n)
+        best[:] = np.nan
+        best[self.G.nodes()] = -np.inf
+        parent = np.zeros(n, dtype=int)
+        parent[:] = -1
+        
+        i, j, w = [], [], []
+        for count in range(len(self.G.nodes())):
+            # add the node with the strongest link to the tree, or start a new tree if none are linked
+            v = np.nanargmax(best)
+            if parent[v] != -1:
+                i.append(parent[v])
+                j.append(v)
+                w.append(sign * best[v])
+            best[v] = np.nan
+            
+            # update the strongest links to the tree of the nodes not yet in it
+            row = sign * self.adjRow(v)
+            with np.errstate(invalid='ignore'):
+                update = row > best # False for NaNs, so the tree and missing edges are skipped
+            best[update] = row[update]
+            parent[update] = v
+        
+        i, j, w = np.array(i, dtype=int), np.array(j, dtype=int), np.array(w, dtype=self.dtype)
+        if makeGraph:
+            self.setEdges(i, j, w)
+        
+        return i, j, w
+
     def minimum_spanning_edges(self, weight='weight', data=True):
         """Generate edges in a minimum spanning forest of an undirected 
         weighted graph.
@@ -1207,42 +2728,39 @@ class brainObj:
         else:
             duffNode = nodeList
             
-        nodes = [v for v in self.G.nodes() if v!=duffNode]
-        nodes = [v for v in nodes if not v in nodeList]
+        if isinstance(nodeList, list):
+            exclNodes = set(nodeList + [duffNode])
+        else:
+            exclNodes = set([duffNode])
+
+        # only consider nodes with connections if desired
+        if connected:
+            degrees = self.G.degree()
+            nodes = [v for v in self.G.nodes() if not v in exclNodes and degrees[v] > 0]
+        else:
+            nodes = [v for v in self.G.nodes() if not v in exclNodes]
+
+        if not nodes:
+            return None
+
+        try:
+            pos = self.nodeCoords([duffNode])[0]
+            xyz = self.nodeCoords(nodes)
+        except KeyError:
+            print "Finding the spatially nearest node requires x,y,z values"
+            return None
 
-        shortestnode = (None, None)
-        
         # get the contralaterally closest node if desired
-        pos = [v for v in self.G.node[duffNode]['xyz']]
         if contra:
             if pos[0] < midline:
                 pos[0] = midline + (midline - pos[0])
             else:
                 pos[0] = midline + (pos[0] - midline)
-        pos = tuple(pos)
-            
-        for node in nodes:
-            try:
-                distance = np.linalg.norm(np.array(pos - np.array(self.G.node[node]['xyz'])))
-            except:
-                print "Finding the spatially nearest node requires x,y,z values"
-                
-            if shortestnode[0]:
-                if distance < shortestnode[1]:
-                    if connected:
-                        if self.G.degree(node) > 0:
-                            shortestnode = (node, distance)
-                    else:
-                        shortestnode = (node, distance)
-            
-            else:
-                if connected:
-                    if self.G.degree(node) > 0:
-                        shortestnode = (node, distance)
-                else:
-                    shortestnode = (node, distance)
-                    
-        return shortestnode[0]
+
+        # distances to all the other nodes at once
+        distances = np.sqrt(np.sum((xyz - pos)**2, axis=1))
+
+        return nodes[np.argmin(distances)]
         
     
     def findSpatiallyNearestNew(self, nodeList, threshold=1.):
@@ -1352,6 +2870,8 @@ class brainObj:
         
         for edge in self.G.edges():
                 self.G.edge[edge[0]][edge[1]]["distance"] = eMax - self.G.edge[edge[0]][edge[1]]["weight"] # convert weights to a positive distance
+        
+        self.graphChanged() # path lengths by distance are out of date
                 
         
     ### hubs
@@ -1514,13 +3034,16 @@ class brainObj:
         '''
 
         
-        W = self.adjMat.copy()
+        if self.adjMat is None and not self.packedAdj is None:
+            W = extraFns.unpackTriangle(self.packedAdj) # unpack without keeping a copy of the full matrix
+        else:
+            W = self.getAdjMat().copy()
         n0 = len(W)                                # number of nodes
         
         W = np.ma.array(W, mask=False)    # convert to masked array
         W.mask = W.data
         W.mask = False
-        W[np.isnan(self.adjMat)] = 0.
+        W[np.isnan(W.data)] = 0.
         
         h=0                                     # hierarchy index
         Ci = { h:np.ma.array(np.zeros(n0),mask=False, dtype=int) } # create dictionary of hierarchy assignments and blank arrays
@@ -1549,13 +3072,13 @@ class brainObj:
         
         # get rid of nan's
         W = W[np.invert(W.mask)]
-        W.shape = np.repeat(np.sqrt(len(W)),2)
+        W.shape = np.repeat(int(round(np.sqrt(len(W)))),2)
         n = len(W)
 
-        s = np.sum(W)                           # weight of edges
+        s = np.sum(W, dtype=float)              # weight of edges, summed in double precision for small dtypes
     
         while 1:
-            K = np.sum(W, axis=1)                   # node degree
+            K = np.sum(W, axis=1, dtype=float)      # node degree
             Km = K.copy()                            # module degree
             Knm = W.copy()                          # node-to-module degree
             
@@ -1606,11 +3129,11 @@ class brainObj:
             
             n = len(x)                                 # new number of modules
             
-            W1 = np.zeros((n,n))                            # new weighted matrix
+            W1 = np.zeros((n,n), dtype=W.dtype)             # new weighted matrix
     
             for i in range(n):
                 for j in range(i,n):                          # pool weights of nodes in same module w=sum(sum(W(M1==i,M1==j)));
-                    A = np.zeros(W.shape)
+                    A = np.zeros(W.shape, dtype=W.dtype)
                     indRow = np.array([z for z,v in enumerate(M1) if v==i])
                     indCol = np.array([z for z,v in enumerate(M1) if v==j])
                     
@@ -1642,17 +3165,83 @@ class brainObj:
             
     #!! clusters function removed
             
-    def thresholdToPercentage(self, threshold):
+    def edgesAbove(self, threshold, blockSize=1000):
+        '''
+        Count the possible edges with weights greater than threshold, in both
+        directions, i.e. the values of the adjacency matrix above threshold
+        leaving out the diagonal. Undirected edges are taken from the upper
+        triangle, as in applyThreshold, and counted twice, so the full, packed
+        and sparse matrices of a brain give the same count.
+        
+        If the sorted weight index has been made for the current adjacency
+        matrix (see sortedWeights) this is a binary search of it. Otherwise
+        the values are counted on the matrix, or the packed or sparse matrix,
+        without copying it, blockSize rows at a time.
+        '''
+        if self.weightIndexKey == self.adjKey() and not self.weightIndex is None:
+            count = len(self.weightIndex) - np.searchsorted(self.weightIndex, threshold, side='right')
+        
+        elif self.adjMat is None and not self.sparseAdj is None:
+            if self.directed:
+                count = np.count_nonzero(self.sparseAdj.data > threshold)
+            else:
+                from scipy import sparse
+                count = np.count_nonzero(sparse.triu(self.sparseAdj, k=1).data > threshold)
+        
+        elif self.adjMat is None and not self.packedAdj is None:
+            count = np.count_nonzero(self.packedAdj > threshold)
+        
+        else:
+            count = 0
+            n = self.adjMat.shape[1]
+            for start in range(0, len(self.adjMat), blockSize):
+                above = self.adjMat[start:start+blockSize] > threshold
+                if not self.directed:
+                    above &= np.arange(start, start+len(above))[:,np.newaxis] < np.arange(n)
+                count += np.count_nonzero(above)
+        
+        if self.directed:
+            # the diagonal is in the weights counted, but isn't a possible edge
+            return count - np.count_nonzero(self.diagonalWeights() > threshold)
+        else:
+            # each undirected edge is in the matrix twice
+            return 2 * count
+
+    def diagonalWeights(self):
+        ''' get the weights on the diagonal of the adjacency matrix, leaving out
+            NaNs and, for a sparse matrix, entries that aren't stored. A packed
+            matrix has no diagonal. '''
+        
+        if self.adjMat is None and not self.sparseAdj is None:
+            n = self.sparseAdj.shape[0]
+            pos = self.sparsePositions(np.arange(n), np.arange(n))
+            weights = self.sparseAdj.data[pos[pos >= 0]]
+        elif self.adjMat is None and not self.packedAdj is None:
+            weights = np.zeros(0, dtype=self.packedAdj.dtype)
+        else:
+            weights = np.diagonal(self.adjMat)
+        
+        return weights[~np.isnan(weights)]
+
+    def thresholdToPercentage(self, threshold, blockSize=1000):
         '''
         Functional to convert a threshold to a percentage connectivity.
         
         As this is returns a ratio between nodes and edges, it doesn't matter
         whether the graph is directed (ie an asymmetric association matrix)
+        
+        The edges are counted by edgesAbove, which reads blockSize rows of the
+        adjacency matrix at a time unless the sorted weights can be used. It
+        leaves out the diagonal, so the percentage doesn't depend on whether
+        the matrix is full, packed or sparse.
         '''
-        lenNodes = float(len(self.G.nodes()))
+        if self.coreCurrent():
+            lenNodes = float(self.core.numberOfNodes())
+        else:
+            lenNodes = float(self.G.number_of_nodes())
         maxEdges = float(lenNodes) * (lenNodes-1)
         
-        lenEdges = len(self.adjMat.flatten()[self.adjMat.flatten()>threshold])
+        lenEdges = self.edgesAbove(threshold, blockSize=blockSize)
 
         pc = lenEdges / maxEdges
         return(pc)
@@ -1663,11 +3252,15 @@ class brainObj:
         This returns the percentage of the total number of possible connections
         where an edge actually exists.
         '''
+        if self.coreCurrent():
+            lenNodes, lenEdges = self.core.numberOfNodes(), self.core.numberOfEdges()
+        else:
+            lenNodes, lenEdges = self.G.number_of_nodes(), self.G.number_of_edges()
         if self.directed:
-            totalConnections = len(self.G.nodes()*(len(self.G.nodes())-1))
+            totalConnections = lenNodes * (lenNodes-1)
         else:
-            totalConnections = len(self.G.nodes()*(len(self.G.nodes())-1)) / 2
-        self.percentConnections = float(len(self.G.edges()))/float(totalConnections)
+            totalConnections = lenNodes * (lenNodes-1) / 2
+        self.percentConnections = float(lenEdges)/float(totalConnections)
         
         return self.percentConnections
         
@@ -1676,25 +3269,46 @@ class brainObj:
         self.bigconnG = components.connected.connected_component_subgraphs(self.G)[0]  # identify largest connected component
 
                 
-    def checkrobustness(self, conVal, step):
-        ''' Robustness is a measure that starts with a fully connected graph, \
-        then reduces the threshold incrementally until the graph breaks up in \
-        to more than one connected component. The robustness level is the \
-        threshold at which this occurs. '''
-
-        self.adjMatThresholding(edgePC = conVal)
-        conVal -= step
-        
-        sgLenStart = len(components.connected.connected_component_subgraphs(self.G))
-        #print "Starting sgLen: "+str(sgLenStart)
-        sgLen = sgLenStart
-
-        while(sgLen == sgLenStart and conVal > 0.):
-            self.adjMatThresholding(edgePC = conVal)
-            sgLen = len(components.connected.connected_component_subgraphs(self.G))  # identify largest connected component
-            conVal -= step
-            # print "New connectivity:" +str(conVal)+ " Last sgLen:" + str(sgLen)
-        return conVal+ (2*step)
+    def componentCurve(self):
+        ''' Get the number of connected components of the nodes in G against
+        density, as edges are added in decreasing order of weight. Densities are
+        percentages of the possible edges, as for edgePC in applyThreshold.
+        
+        Returns an array of the densities at which the number of components
+        changes and an array of the number of components from each density on,
+        starting at density 0 with no edges. Where edges of the same weight join
+        several components, the density is repeated. This is also kept in
+        self.robustnessCurve. The components are found with a single union-find
+        pass over the edges (see extraFns.componentJoins). '''
+        
+        i, j, w = self.sortedEdges()
+        joins = extraFns.componentJoins(i, j, self.G.nodes())
+        
+        # density including each joining edge, found as applyThreshold would
+        densities = np.concatenate(([0.], self.weightDensities(w[joins])))
+        nComps = len(self.G.nodes()) - np.arange(len(densities))
+        
+        self.robustnessCurve = (densities, nComps)
+        return densities, nComps
+        
+    def checkrobustness(self, conVal=100., step=None):
+        ''' Robustness is a measure that starts with a graph thresholded at a
+        density of conVal percent (fully connected by default), then reduces the
+        density until the graph breaks up in to more connected components. The
+        robustness level is the lowest density (as a percentage of possible edges)
+        at which the graph still has as few components as at conVal.
+        
+        This is found exactly from componentCurve, rather than by thresholding
+        in steps, so step is no longer needed. The whole curve of the number of
+        components against density is kept in self.robustnessCurve. '''
+        
+        densities, nComps = self.componentCurve()
+        
+        # number of components at the starting density
+        startComps = nComps[np.searchsorted(densities, conVal, side='right')-1]
+        
+        # the components decrease by one at each density in the curve
+        return densities[nComps[0] - startComps]
         
     ### brain connectivity toolbox
     def makebctmat(self):
@@ -1706,7 +3320,7 @@ class brainObj:
         the resulting matrix may not match the node number in the maybrain
         networkx object
         """
-        self.bctmat = np.zeros((len(self.G.nodes()),len(self.G.nodes())))
+        self.bctmat = np.zeros((len(self.G.nodes()),len(self.G.nodes())), dtype=self.dtype)
         nodeIndices = dict(zip(self.G.nodes(), range(len(self.G.nodes()))))
         for nn,x in enumerate(self.G.nodes()):
             for y in self.G.edge[x].keys():
@@ -1753,30 +3367,13 @@ class highlightObj():
         ''' turn list of edges into lists of coordinates - note that the second set of coordinates are the 
         vector from the first to the second points of the edge '''
         
-        # initialise outputs
-        x1 = []
-        x2 = []
-        y1 = []
-        y2 = []
-        z1 = []
-        z2 = []
-        s = []
-                
-        for e in self.edgeIndices:
-            # get coordinates of edge indices
-            p1 = brain.G.node[e[0]]['xyz']
-            p2 = brain.G.node[e[1]]['xyz']    
-            
-            x1.append(p1[0])
-            x2.append(p2[0]-p1[0]) 
-            
-            y1.append(p1[1])
-            y2.append(p2[1]-p1[1])
-            
-            z1.append(p1[2])
-            z2.append(p2[2]-p1[2])
-            
-            s.append(brain.G.edge[e[0]][e[1]]['weight'])
+        # coordinates of the start and end of every edge, read as arrays
+        p1 = brain.nodeCoords([e[0] for e in self.edgeIndices])
+        p2 = brain.nodeCoords([e[1] for e in self.edgeIndices])
+        x1, y1, z1 = p1.T
+        x2, y2, z2 = (p2 - p1).T
+        
+        s = [brain.G.edge[e[0]][e[1]]['weight'] for e in self.edgeIndices]
             
         return x1, y1, z1, x2, y2, z2, s
         
@@ -1784,16 +3381,7 @@ class highlightObj():
     def getCoords(self, brain):
         ''' turn indices of points into coordinates '''
 
-        x = []
-        y = []
-        z = []        
-        
-        for p in self.nodeIndices:
-            pc = brain.G.node[p]['xyz']
-            # pc = brain.G.node[p[1]]['xyz']
-            x.append(pc[0])
-            y.append(pc[1])
-            z.append(pc[2])
+        x, y, z = brain.nodeCoords(self.nodeIndices).T
             
         return x, y, z
         
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Functions and objects for groups of subjects
+
+The cohortObj class holds the association matrices of many subjects in a
+single stacked subjects x nodes x nodes array, which can be stored in a
+numpy memmap for large groups. Files are parsed in parallel in a pool of
+processes and brainObj instances for single subjects are made on demand.
+
+"""
+
+from os import path
+from glob import glob
+import multiprocessing
+import numpy as np
+
+from brainObjs import brainObj
+import extraFns
+
+
+def loadSubject(args):
+    '''
+    Read the association matrix of one subject, used by the process pool in
+    cohortObj.importAdjFiles. If a memmap file is given the matrix and its
+    mask are written straight in to it, otherwise they are returned.
+    '''
+    s, fname, delimiter, naVals, exclnodes, shape, mmapFile, dtype = args
+
+    adjMat = extraFns.readAdjFile(fname, delimiter=delimiter, naVals=naVals, dtype=dtype)
+    if adjMat.shape != shape[1:]:
+        raise ValueError(fname + ' has shape ' + str(adjMat.shape) + ', expected ' + str(shape[1:]))
+
+    # null values of excluded nodes
+    if exclnodes:
+        adjMat[:,exclnodes] = np.nan
+        adjMat[exclnodes,:] = np.nan
+
+    if mmapFile:
+        adjMats = np.memmap(mmapFile, dtype=dtype, mode="r+", shape=shape)
+        masks = np.memmap(mmapFile+'.mask', dtype=bool, mode="r+", shape=shape)
+        adjMats[s] = adjMat
+        masks[s] = np.isnan(adjMat)
+        adjMats.flush()
+        masks.flush()
+        del(adjMats, masks)
+        return s, None
+
+    return s, adjMat
+
+
+def edgeIndices(n, directed=False):
+    '''
+    Get the rows and columns of the possible edges of an n x n association
+    matrix, the upper triangle if undirected and everything but the diagonal
+    if directed.
+    '''
+    if directed:
+        return np.where(~np.eye(n, dtype=bool))
+    else:
+        return np.triu_indices(n, 1)
+
+
+def subjectThresholds(W, thresholdType='edgePC', value=0.):
+    '''
+    Get the threshold for each row of W, an array of the possible edge
+    weights of one subject per row with missing values as -inf, using
+    thresholdType 'edgePC', 'totalEdges' or 'tVal' as in
+    brainObj.applyThreshold.
+    '''
+    if thresholdType == 'tVal':
+        return np.repeat(float(value), len(W))
+
+    # sort the weights of each subject in decreasing order, missing values last
+    sortedW = -np.sort(-W, axis=1)
+    nEdges = np.sum(~np.isinf(sortedW), axis=1)
+
+    if thresholdType == 'edgePC':
+        edgeNums = ((value/100.) * nEdges).astype(int)
+    else:
+        edgeNums = np.repeat(int(value), len(W))
+
+    # threshold at the weakest edge kept, as in brainObj.edgeThreshold
+    pos = np.clip(np.minimum(edgeNums, nEdges) - 1, 0, W.shape[1]-1)
+    thresholds = sortedW[np.arange(len(W)), pos]
+    thresholds[edgeNums <= 0] = sortedW[edgeNums <= 0, 0] + 0.5
+    thresholds[nEdges == 0] = np.inf
+
+    return thresholds
+
+
+class cohortObj:
+    """
+    A group of subjects, with the association matrix of every subject in one
+    array, self.adjMats, of shape subjects x nodes x nodes. self.masks is a
+    boolean array of the same shape that is True where a value is missing,
+    either NA in the file or an excluded node.
+    """
+
+    def __init__(self, directed=False, dtype="float64"):
+        '''
+        Initialise the cohort. dtype is the numpy type of the association
+        matrices, as for brainObj.
+        '''
+
+        self.directed = directed # are the subjects' graphs directed or not?
+        self.dtype = np.dtype(dtype) # type of the association matrix values
+
+        self.subjects = [] # file names of the subjects
+        self.adjMats = None # subjects x nodes x nodes array of association matrices
+        self.masks = None # True where values are missing for each subject
+        self.exclnodes = {} # excluded nodes for each subject
+        self.thresholds = None # threshold for each subject, see thresholdSubjects
+        self.edges = [] # start nodes, end nodes and weights of the edges of each subject
+
+    def importAdjFiles(self, fnames, delimiter=None, exclnodes=[], naVals=["NA"],
+                       pattern="*", processes=None, mmapFile=None):
+        '''
+        Import the association matrices of many subjects. fnames is either a
+        list of files or a directory, in which case the files matching
+        pattern are used in alphabetical order. All the matrices must be the
+        same size.
+
+        Files are parsed in parallel by a pool of processes, by default one
+        for each cpu, processes=1 reads them one at a time. If mmapFile is
+        given, adjMats is a numpy memmap in that file (and masks in
+        mmapFile.mask) and each process writes its subjects straight in to it.
+
+        exclnodes is either a list of nodes to exclude for all subjects, or a
+        dictionary of lists for each file name.
+        '''
+        if isinstance(fnames, basestring) and path.isdir(fnames):
+            fnames = sorted(glob(path.join(fnames, pattern)))
+        self.subjects = list(fnames)
+
+        if isinstance(exclnodes, dict):
+            self.exclnodes = {v:exclnodes.get(v, []) for v in self.subjects}
+        else:
+            self.exclnodes = {v:exclnodes for v in self.subjects}
+
+        # get the size of the matrices from the first file
+        startLine, nRows, nCols = extraFns.adjFileShape(self.subjects[0], delimiter)
+        shape = (len(self.subjects), nRows, nCols)
+
+        if mmapFile:
+            self.adjMats = np.memmap(mmapFile, dtype=self.dtype, mode="w+", shape=shape)
+            self.masks = np.memmap(mmapFile+'.mask', dtype=bool, mode="w+", shape=shape)
+        else:
+            self.adjMats = np.empty(shape, dtype=self.dtype)
+            self.masks = np.empty(shape, dtype=bool)
+
+        args = [(s, fname, delimiter, naVals, self.exclnodes[fname], shape, mmapFile, self.dtype.name) for s,fname in enumerate(self.subjects)]
+
+        if processes == 1:
+            self.storeSubjects(map(loadSubject, args))
+        else:
+            # stop the workers if a subject fails to load
+            pool = multiprocessing.Pool(processes)
+            try:
+                self.storeSubjects(pool.imap_unordered(loadSubject, args))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+    def storeSubjects(self, results):
+        ''' keep the matrices loaded by loadSubject in the cohort arrays '''
+
+        for s,adjMat in results:
+            if not adjMat is None:
+                self.adjMats[s] = adjMat
+                self.masks[s] = np.isnan(adjMat)
+
+    def brain(self, s):
+        '''
+        Get a brainObj for subject s, which can be an index or a file name.
+        The brain's adjacency matrix is a read only view of the cohort array
+        rather than a copy, so it is only copied if the brain changes it (see
+        brainObj.ownAdjMat) and the cohort is never changed through it.
+        '''
+        if not isinstance(s, (int, long)):
+            s = self.subjects.index(s)
+
+        br = brainObj(directed=self.directed, dtype=self.dtype)
+        br.adjMat = br.readOnly(self.adjMats[s])
+        br.adjMatChanged()
+        br.exclnodes = self.exclnodes[self.subjects[s]]
+
+        exclSet = set(br.exclnodes)
+        br.G.add_nodes_from([v for v in range(len(br.adjMat)) if not v in exclSet])
+
+        return br
+
+    def thresholdSubjects(self, thresholdType='edgePC', value=0., weighted=True, blockSize=10):
+        '''
+        Threshold all the subjects at once, with thresholdType 'edgePC',
+        'totalEdges' or 'tVal' as in brainObj.applyThreshold. Each subject
+        gets its own threshold, found for blockSize subjects at a time from
+        the stacked matrices, so no brainObj or networkx graph is made.
+
+        Sets self.thresholds, the threshold for each subject, and self.edges,
+        a list with the start nodes, end nodes and weights of each subject's
+        edges as arrays (weights are all 1 if weighted is False). These can be
+        given to brainObj.setEdges, or used directly, e.g. by subjectDegrees.
+        '''
+        nSubj, n = self.adjMats.shape[:2]
+        i, j = edgeIndices(n, self.directed)
+
+        self.thresholds = np.zeros(nSubj)
+        self.edges = []
+        for start in range(0, nSubj, blockSize):
+            W = self.adjMats[start:start+blockSize, i, j]
+            W[np.isnan(W)] = -np.inf
+
+            thresholds = subjectThresholds(W, thresholdType, value)
+            self.thresholds[start:start+len(W)] = thresholds
+            mask = W >= thresholds[:,np.newaxis]
+
+            for s in range(len(W)):
+                k = np.where(mask[s])[0]
+                if weighted:
+                    w = W[s,k]
+                else:
+                    w = np.ones(len(k), dtype=W.dtype)
+                self.edges.append((i[k], j[k], w))
+
+        return self.edges
+
+    def subjectDegrees(self):
+        '''
+        Get the degree of every node for every subject, from the edges found
+        by thresholdSubjects, as a subjects x nodes array.
+        '''
+        n = self.adjMats.shape[1]
+        degrees = np.zeros((len(self.edges), n), dtype=int)
+        for s,(i,j,w) in enumerate(self.edges):
+            degrees[s] = np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+
+        return degrees
+
+    def subjectMatrices(self, fnames=None, delimiter=None, naVals=["NA"]):
+        '''
+        Generator giving the association matrix of each subject in turn,
+        either from adjMats or, if fnames is given, read from the files one at
+        a time so that the whole cohort never needs to be in memory. Excluded
+        nodes for each file are taken from self.exclnodes.
+        '''
+        if fnames is None:
+            for s in range(len(self.adjMats)):
+                yield self.adjMats[s]
+            return
+
+        if isinstance(fnames, basestring) and path.isdir(fnames):
+            fnames = sorted(glob(path.join(fnames, "*")))
+
+        for fname in fnames:
+            adjMat = extraFns.readAdjFile(fname, delimiter=delimiter, naVals=naVals, dtype=self.dtype)
+            exclnodes = self.exclnodes.get(fname, [])
+            if exclnodes:
+                adjMat[:,exclnodes] = np.nan
+                adjMat[exclnodes,:] = np.nan
+            yield adjMat
+
+    def consensusBrain(self, presence=None, maxCV=None, thresholdType='tVal', value=0.,
+                       fnames=None, delimiter=None, naVals=["NA"]):
+        '''
+        Make a group consensus brain from the subjects, streamed one at a time
+        (see subjectMatrices), so memory depends on the number of nodes and not
+        on the number of subjects.
+
+        An edge is present for a subject if it is kept by thresholding that
+        subject with thresholdType and value, as in brainObj.applyThreshold (by
+        default any weight of at least 0). The consensus edges are those present
+        in at least presence percent of subjects and, if maxCV is given, with a
+        coefficient of variation (standard deviation / mean of the weights
+        across subjects) of at most maxCV.
+
+        The counts, means and variances are accumulated with Welford's method.
+        Returns a brainObj whose adjacency matrix holds the mean weights and
+        whose edges are the consensus edges, weighted by their means. The
+        proportion of subjects with each edge and the coefficients of
+        variation are kept in the brain's edge attributes 'presence' and 'cv'.
+        '''
+        i = j = None
+        nSubj = 0
+        for adjMat in self.subjectMatrices(fnames, delimiter=delimiter, naVals=naVals):
+            if i is None:
+                n = len(adjMat)
+                i, j = edgeIndices(n, self.directed)
+                counts = np.zeros(len(i), dtype=int) # subjects with the edge
+                nValid = np.zeros(len(i), dtype=int) # subjects with a weight for the edge
+                mean = np.zeros(len(i))
+                M2 = np.zeros(len(i)) # sum of squared differences from the mean
+
+            x = np.array(adjMat[i,j], dtype=float)
+            valid = ~np.isnan(x)
+            x[~valid] = -np.inf
+            counts += x >= subjectThresholds(x[np.newaxis], thresholdType, value)[0]
+
+            # update the running mean and variance of the weights
+            x = x[valid]
+            nValid[valid] += 1
+            delta = x - mean[valid]
+            mean[valid] += delta / nValid[valid]
+            M2[valid] += delta * (x - mean[valid])
+            nSubj += 1
+
+        if nSubj == 0:
+            raise ValueError('no subjects to make a consensus brain from')
+
+        # consensus edges
+        pc = 100. * counts / nSubj
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # the variation is unknown for edges with fewer than two weights
+            std = np.where(nValid > 1, np.sqrt(M2 / (nValid-1)), np.nan)
+            cv = np.where(mean != 0, std / np.abs(mean), np.inf)
+        keep = nValid > 0
+        if not presence is None:
+            keep &= pc >= presence
+        if not maxCV is None:
+            with np.errstate(invalid='ignore'):
+                keep &= cv <= maxCV
+
+        # brain of the mean weights and consensus edges
+        br = brainObj(directed=self.directed, dtype=self.dtype)
+        br.adjMat = np.empty((n,n), dtype=self.dtype)
+        br.adjMat[:] = np.nan
+        br.adjMat[i[nValid>0], j[nValid>0]] = mean[nValid>0]
+        if not self.directed:
+            br.adjMat[j[nValid>0], i[nValid>0]] = mean[nValid>0]
+        br.adjMatChanged()
+
+        linked = np.bincount(i[nValid>0], minlength=n) + np.bincount(j[nValid>0], minlength=n)
+        br.G.add_nodes_from([v for v in range(n) if linked[v]])
+        br.setEdges(i[keep], j[keep], mean[keep])
+        for a,b,p,c in zip(i[keep].tolist(), j[keep].tolist(), (pc[keep]/100.).tolist(), cv[keep].tolist()):
+            br.G.edge[a][b]['presence'] = p
+            br.G.edge[a][b]['cv'] = c
+
+        return br
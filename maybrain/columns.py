@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Columns of node and edge properties stored as arrays.
+
+Numbers are kept as plain numpy arrays. Strings, which usually take only a
+few distinct values (e.g. anatomical labels or module names), are kept as a
+categorical column: an array of integer codes in to an array of the distinct
+strings. Missing strings have a code of -1, so they don't equal any string.
+
+"""
+
+import numpy as np
+
+
+class categorical:
+    """
+    A column of strings stored as integer codes, where element n is
+    categories[codes[n]], or missing if codes[n] is -1. Indexing gives strings
+    as for a numpy string array, '' for missing values, so it can be used in
+    place of one.
+    """
+
+    def __init__(self, vals=None, codes=None, categories=None, missing=None):
+        '''
+        Give either vals, an array of strings, or the codes and categories.
+        missing is a boolean array of the elements of vals without a value.
+        '''
+        if not vals is None:
+            vals = np.asarray(vals)
+            if missing is None:
+                missing = np.zeros(len(vals), dtype=bool)
+            categories, inv = np.unique(vals[~missing], return_inverse=True)
+            categories = categories.astype(vals.dtype)
+            codes = np.zeros(len(vals), dtype=np.int32) - 1
+            codes[~missing] = inv
+        self.categories = np.asarray(categories)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.dtype = self.categories.dtype
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, k):
+        # code -1 gives the '' added to the end of the categories
+        return np.append(self.categories, np.zeros(1, dtype=self.dtype))[self.codes[k]]
+
+    def __setitem__(self, k, vals):
+        # add any new strings to the categories, keeping them sorted
+        cats = np.union1d(self.categories, np.atleast_1d(vals))
+        self.codes = np.append(np.searchsorted(cats, self.categories), -1).astype(np.int32)[self.codes]
+        self.categories = cats
+        self.dtype = cats.dtype
+        self.codes[k] = np.searchsorted(cats, vals)
+
+    def code(self, val):
+        ''' the code of the string val, -1 if it isn't in the column '''
+        k = np.searchsorted(self.categories, val)
+        if k < len(self.categories) and self.categories[k] == val:
+            return k
+        return -1
+
+    def equals(self, val):
+        ''' boolean array of the elements equal to the string val, comparing codes '''
+        k = self.code(val)
+        if k < 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == k
+
+    def decode(self):
+        ''' the column as a numpy string array, '' for missing values '''
+        return self[:]
+
+    def take(self, k):
+        ''' the elements k as a categorical column '''
+        return categorical(codes=self.codes[k], categories=self.categories)
+
+
+def makeColumn(vals):
+    ''' store an array of values as a column, categorical for strings '''
+
+    if isinstance(vals, categorical):
+        return vals
+    vals = np.asarray(vals)
+    if vals.dtype.kind in 'SU':
+        return categorical(vals)
+    return vals
+
+def hasValues(col, k):
+    ''' boolean array of the elements k of a column that aren't missing strings.
+        Missing numbers are NaN, which compare false anyway. '''
+
+    if isinstance(col, categorical):
+        return col.codes[k] >= 0
+    return np.ones(len(np.asarray(col)[k]), dtype=bool)
+
+def take(col, k):
+    ''' the elements k of a column '''
+
+    if isinstance(col, categorical):
+        return col.take(k)
+    return np.asarray(col)[k]
+
+def concatenate(a, b):
+    ''' join two columns, keeping missing strings missing '''
+
+    if isinstance(a, categorical) or isinstance(b, categorical):
+        a, b = makeColumn(a), makeColumn(b)
+        if isinstance(a, categorical) and isinstance(b, categorical):
+            cats = np.union1d(a.categories, b.categories)
+            codes = [np.append(np.searchsorted(cats, c.categories), -1).astype(np.int32)[c.codes] for c in [a, b]]
+            return categorical(codes=np.concatenate(codes), categories=cats)
+        a, b = [c.decode() if isinstance(c, categorical) else c for c in [a, b]]
+    return np.concatenate((np.asarray(a), np.asarray(b)))
+
+def columnToArrays(col, name):
+    ''' split a column in to arrays that numpy can save, with keys starting
+        with name, see columnFromArrays '''
+
+    if isinstance(col, categorical):
+        return {name+'Codes':col.codes, name+'Categories':col.categories}
+    return {name:np.asarray(col)}
+
+def columnFromArrays(arrays, name):
+    ''' recreate a column saved with columnToArrays '''
+
+    if name+'Codes' in arrays:
+        return categorical(codes=arrays[name+'Codes'], categories=arrays[name+'Categories'])
+    return arrays[name]
+
+def columnArrayNames(name):
+    ''' the names of the arrays columnToArrays might give for a column '''
+    return [name, name+'Codes', name+'Categories']
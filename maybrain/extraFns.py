@@ -14,6 +14,8 @@ from networkx import connected_component_subgraphs as ccs
 import random
 from numpy import linalg as lg
 from random import shuffle
+import graphCore
+import columns
 
 def efficiencyfunc(node, G, weight=None):
     pls = nx.shortest_path_length(G, source=node, weight=weight)
@@ -24,18 +26,84 @@ def efficiencyfunc(node, G, weight=None):
     
     return(invpl)
     
-def globalefficiency(G, weight=None):
+def pathCore(G, weight=None):
+    """
+    The nodes of G and its edges as a graphCore.csrGraph between their
+    positions in that list, with the weight property of the edges as lengths
+    if weight is given.
+    """
+    nodes = G.nodes()
+    nodeIndices = dict(zip(nodes, range(len(nodes))))
+    edges = G.edges(data=True)
+    ePos = edgePositions(edges, nodeIndices)
+    if weight:
+        w = np.array([e[2].get(weight, 1.) for e in edges], dtype=float)
+    else:
+        w = np.ones(len(edges))
+
+    return nodes, graphCore.csrGraph(len(nodes), ePos[:,0], ePos[:,1], w, directed=G.is_directed())
+
+def pathLengths(G, weight=None):
+    """
+    All pairs shortest path lengths of G, as a list of the nodes and a matrix
+    of the path lengths between them in that order, inf where there is no
+    path. Path lengths are numbers of edges, or the sum of the weight property
+    of the edges if weight is given, as for nx.shortest_path_length.
+
+    The efficiency functions below take this as paths, so that they can share
+    one calculation (see also brainObj.pathLengths, which keeps it until G
+    changes).
+    """
+    nodes, core = pathCore(G, weight=weight)
+    return nodes, core.distances(weighted=bool(weight))
+
+def inversePathSums(D, sources=None):
+    """
+    The sum of 1/d over the paths from each node to every other node, where
+    row n of D holds the path lengths from node n, or from node sources[n] if
+    D only has the rows for some of the nodes.
+    """
+    with np.errstate(divide='ignore'):
+        inv = 1. / D
+    if sources is None:
+        np.fill_diagonal(inv, 0.)
+    else:
+        inv[np.arange(len(sources)), sources] = 0.
+    return np.sum(inv, axis=1)
+
+pathBlockSize = 1000 # source nodes per block of path lengths in efficiencySums
+
+def efficiencySums(G, weight=None, paths=None):
+    """
+    The nodes of G and the sums of 1/d over the paths from each of them, from
+    paths if it is given. Otherwise the path lengths are found for
+    pathBlockSize source nodes at a time, so that no more than a
+    pathBlockSize x N block of them is held at once.
+    """
+    if not paths is None:
+        nodes, D = paths
+        return nodes, inversePathSums(D)
+
+    nodes, core = pathCore(G, weight=weight)
+    sums = np.zeros(len(nodes))
+    for start in range(0, len(nodes), pathBlockSize):
+        sources = np.arange(start, min(start+pathBlockSize, len(nodes)))
+        D = core.distances(weighted=bool(weight), sources=sources)
+        sums[sources] = inversePathSums(D, sources=sources)
+    return nodes, sums
+
+def globalefficiency(G, weight=None, paths=None):
     """
     A set of definitions to calculate global efficiency and local efficiency.
     Definitions are taken from Latora and Marchiori 2001, Physical Review
     Letters. 
+    
+    paths can be the output of pathLengths for G, so that it isn't found again.
     """
+    nodes, sums = efficiencySums(G, weight=weight, paths=paths)
 
-    N = float(len(G.nodes())) # count nodes
-    ssl = 0            # sum of inverse of the shortest path lengths
-    
-    ssl = [ efficiencyfunc(v, G, weight=weight) for v in G.nodes() ]
-    ssl = np.sum(np.array((ssl)))
+    N = float(len(nodes)) # count nodes
+    ssl = np.sum(sums) # sum of inverse of the shortest path lengths
     
     if N>1:
         Geff = float(ssl) / (N*N-N)
@@ -44,40 +112,50 @@ def globalefficiency(G, weight=None):
         "Number of nodes <1, can't calculate global efficiency"
         return None
 
-def localefficiency(G, nodes=None, weight=None, fc=False):
+def localefficiency(G, nodes=None, weight=None, fc=False, paths=None):
     """
     Returns a dictionary of local efficiency values for each node in the graph.
     fc is a bit of a bodge, specify this if the graph is fully connected to
-    make it computationally possible to run.
+    make it computationally possible to run, paths can then be the output of
+    pathLengths for G.
     """    
+    from scipy.sparse import csgraph, csr_matrix
+
     # if node list is not specified, use all nodes in the graph
     if not nodes:
         nodes = G.nodes()
 
     if weight and fc:
-        outDict = {v:efficiencyfunc(v, G, weight=weight)/(len(G.nodes())-1) for v in G.nodes()}
+        allNodes, sums = efficiencySums(G, weight=weight, paths=paths)
+        outDict = dict(zip(allNodes, (sums/(len(allNodes)-1)).tolist()))
                 
     else:
         outDict={}
 
+        # the graph as a sparse matrix, to take the subgraph of each node's neighbours from
+        allNodes = G.nodes()
+        nodeIndices = dict(zip(allNodes, range(len(allNodes))))
+        edges = G.edges(data=True)
+        ePos = edgePositions(edges, nodeIndices)
+        if weight:
+            w = np.array([e[2].get(weight, 1.) for e in edges], dtype=float)
+            if np.any(w < 0):
+                raise ValueError('shortest paths can not be found with negative edge weights')
+        else:
+            w = np.ones(len(edges))
+        S = csr_matrix((w, (ePos[:,0], ePos[:,1])), shape=(len(allNodes), len(allNodes)))
+
         for node in nodes:
 
-            Ginodes = nx.neighbors(G,node)
+            Ginodes = G.neighbors(node)
             Ginodes.append(node)
-            Giedges = G.edges(Ginodes)
-    
-            Giedges = [ e for e in Giedges if e[1] in Ginodes ]
-            Giedges = [ e for e in Giedges if e[0] in Ginodes ]
-    
-            Gi = nx.Graph()
-            Gi.add_edges_from(Giedges)
-            for e in Gi.edges():
-                Gi.edge[e[0]][e[1]] = G.edge[e[0]][e[1]]
+            g = np.array([nodeIndices[v] for v in Ginodes], dtype=int)
+            Gi = S[g][:,g]
     
-            if Giedges:
-                ssl = [ efficiencyfunc(v,
-                                       Gi,
-                                       weight=weight) for v in Gi.nodes() if not v==node]
+            if Gi.nnz:
+                # paths within the local graph, from every node but this one
+                Di = csgraph.shortest_path(Gi, method='D', directed=False, unweighted=not weight)
+                ssl = inversePathSums(Di)[:-1]
                 
                 # correct by number of edges in local graph
                 locEff = np.sum(ssl) / (len(Ginodes)-1)  # -1 because self connections are not expected
@@ -87,19 +165,23 @@ def localefficiency(G, nodes=None, weight=None, fc=False):
     
     return(outDict)
     
-def nodalefficiency(G, nodes=None):
+def nodalefficiency(G, nodes=None, paths=None):
     """
     Returns a dictionary of nodal efficiency values for each node in the graph.
+    
+    paths can be the output of pathLengths for G, so that it isn't found again.
     """        
     
     # if node list is not specified, use all nodes in the graph
     if not nodes:
         nodes = G.nodes()
     
+    allNodes, sums = efficiencySums(G, paths=paths)
+    nodEffs = dict(zip(allNodes, sums.tolist()))
+    
     outDict={}
     for node in nodes:
-        nodEff = efficiencyfunc(node,G)
-        outDict[node] = nodEff / (len(nodes) * (len(nodes)-1))
+        outDict[node] = nodEffs[node] / (len(nodes) * (len(nodes)-1))
     
     return(outDict)
     
@@ -149,18 +231,82 @@ def robustness(G, iterLen=500, N=50):
         
         fList[i] = nr
     return(np.mean(fList) / len(G.nodes()))
-  
-def edgeLengths(G, nodeWise=False):
-    el =  dict(zip(G.edges(),
-                   [ np.absolute(np.linalg.norm(np.array(G.node[edge[0]]['xyz']) - np.array(G.node[edge[1]]['xyz']))) for edge in G.edges()]))
+
+def componentJoins(i, j, nodes):
+    '''
+    Find the connected components of a graph as its edges, i[k] to j[k], are
+    added one at a time in order, using a union-find (disjoint set) structure
+    so that components are never recalculated. Edge direction is ignored and
+    edges to nodes not in nodes are skipped.
+
+    Returns an array of the positions of the edges that join two components,
+    after the nth of these there are len(nodes)-n-1 components. Stops once
+    all the nodes are connected.
+    '''
+    nodes = list(nodes)
+    nodeIndices = dict(zip(nodes, range(len(nodes))))
+    parent = range(len(nodes))
+    size = [1] * len(nodes)
+
+    def root(x):
+        # find the root of x, halving the path as it goes
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    joins = []
+    nComps = len(nodes)
+    for k,(a,b) in enumerate(zip(i.tolist(), j.tolist())):
+        if nComps <= 1:
+            break
+        if not (a in nodeIndices and b in nodeIndices):
+            continue
+
+        ra, rb = root(nodeIndices[a]), root(nodeIndices[b])
+        if ra != rb:
+            # join the smaller component to the larger
+            if size[ra] < size[rb]:
+                ra, rb = rb, ra
+            parent[rb] = ra
+            size[ra] += size[rb]
+            nComps -= 1
+            joins.append(k)
+
+    return np.array(joins, dtype=int)
+
+def edgeLengths(G, nodeWise=False, xyz=None):
+    """
+    The length of each edge, or the total length of the edges of each node if
+    nodeWise, as dictionaries.
+
+    G can also be an array graph (see graphCore.csrGraph), with xyz the array
+    of node coordinates, e.g. brain.coords. The lengths are then an array in
+    the order of the graph's edges, or of the nodes if nodeWise.
+    """
+    if isinstance(G, graphCore.csrGraph):
+        lengths = G.edgeLengths(xyz)
+        if nodeWise:
+            return np.bincount(G.i, weights=lengths, minlength=G.nNodes) + np.bincount(G.j, weights=lengths, minlength=G.nNodes)
+        return lengths
+
+    # get coordinates for all nodes and edges as arrays
+    nodes = G.nodes()
+    nodeIndices = dict(zip(nodes, range(len(nodes))))
+    edges = G.edges()
+    xyz = np.array([G.node[n]['xyz'] for n in nodes], dtype=float).reshape((len(nodes),3))
+    ePos = edgePositions(edges, nodeIndices)
+
+    lengths = np.sqrt(np.sum((xyz[ePos[:,0]] - xyz[ePos[:,1]])**2, axis=1))
     
     if nodeWise:
-        eln = {}
-        for n in G.nodes():
-            eln[n] = np.sum([el[e] for e in el.keys() if n in e])
-        return(eln)
+        # sum the lengths of the edges at each node
+        nodeLengths = np.zeros(len(nodes))
+        np.add.at(nodeLengths, ePos[:,0], lengths)
+        np.add.at(nodeLengths, ePos[:,1], lengths)
+        return(dict(zip(nodes, nodeLengths.tolist())))
     else:
-        return(el)
+        return(dict(zip(edges, lengths.tolist())))
         
 def histograms(brain, outfilebase="brain"):
     from matplotlib import pyplot as plt
@@ -172,6 +318,7 @@ def histograms(brain, outfilebase="brain"):
     # define lengths for each edge
     for edge in brain.G.edges():
         brain.G.edge[edge[0]][edge[1]]['length'] = abs(lg.norm(np.array(brain.G.node[edge[0]]['xyz']) - np.array(brain.G.node[edge[1]]['xyz'])))
+    brain.graphChanged()
 
     # get a list of weights
     weightList = brain.adjMat.copy()
@@ -211,29 +358,55 @@ def histograms(brain, outfilebase="brain"):
 def withinModuleDegree(G, ci, weight=None):
     """
     To calculate mean within module degree
+
+    weight can be the name of the edge attribute to average, or True for
+    'weight'. G can be a networkx graph, or an array graph (see
+    graphCore.csrGraph) in which case ci can be an array of the module of
+    each node and an array of the values for each node is returned.
     """
-#    moduleList = [v for v in set(ci.values())] # get module list
-    withinDegDict = {}  # output dictionary of nodes and mean within module degree
-#    modDict = {m:[v for v in ci.keys() if ci[v]==m] for m in moduleList} # sort nodes in to modules
+    if weight and not isinstance(weight, basestring):
+        weight = 'weight'
     
-    for n in G.nodes():
-        m = ci[n] # select module
-        
-        eList = G.edges([n])
-        eList = [e for e in eList if all([ci[e[0]]==m, ci[e[1]]==m])] # find edges exclusively within the module
-        
-        if weight:
-            wts = np.sum([float(G.edge[e[0]][e[1]]['weight']) for e in eList])  # get weights/degree
-            wts = wts/float(len(eList))
-        else:
-            wts = float(len(eList))
-        
-        withinDegDict[n] = wts
+    if isinstance(G, graphCore.csrGraph):
+        core = G
+    elif all([isinstance(v, (int, long)) and v >= 0 for v in G.nodes_iter()]):
+        core = graphCore.fromGraph(G, weight=weight or 'weight')
+    else:
+        # the array graph needs integer nodes
+        withinDegDict = {}  # output dictionary of nodes and mean within module degree
+        for n in G.nodes():
+            m = ci[n] # select module
+            
+            eList = G.edges([n])
+            eList = [e for e in eList if all([ci[e[0]]==m, ci[e[1]]==m])] # find edges exclusively within the module
+            
+            if weight:
+                wts = np.sum([float(G.edge[e[0]][e[1]][weight]) for e in eList])  # get weights/degree
+                wts = wts/float(len(eList))
+            else:
+                wts = float(len(eList))
+            
+            withinDegDict[n] = wts
         
-#        if len(modDict[m]) > 1:
-#            withinDegDict[n] = wts/(len(modDict[m])-1)  # mean of weight/degree, ie average degree within module
-#        else:
-#            withinDegDict[n] = 0.
+        return(withinDegDict)
+    
+    if isinstance(ci, dict):
+        # give each module an integer code
+        codes = dict((m,k) for k,m in enumerate(set(ci.values())))
+        ciArr = np.zeros(core.nNodes, dtype=int)
+        for n in core.nodes().tolist():
+            ciArr[n] = codes[ci[n]]
+    else:
+        ciArr = np.asarray(ci)
+    
+    # count edges, or average weights, exclusively within the module of each node
+    withinDeg = core.withinModuleDegree(ciArr, weighted=bool(weight))
+    
+    if isinstance(G, graphCore.csrGraph):
+        return withinDeg
+    
+    nodes = G.nodes()
+    withinDegDict = dict(zip(nodes, withinDeg[np.array(nodes, dtype=int)].tolist()))  # output dictionary of nodes and mean within module degree
             
     return(withinDegDict)
     
@@ -507,22 +680,267 @@ def extractCoordinates(template, outFile="ROI_xyz.txt"):
     out.close()
 
 def undirectedFlatten(mat):
-    ''' flatten function for an undirected matrix '''
+    ''' flatten function for an undirected matrix, giving the upper right
+        triangle row by row. A packed triangle (see packIndex) is already
+        flat, so it is returned as it is rather than copied. The triangle of
+        a full matrix is always a copy, but it is copied row by row in to
+        its packed positions so no other array the size of the matrix is
+        made. '''
+    
+    if np.ndim(mat) == 1:
+        return mat
+    
+    # flatten the upper right section, if there's more rows than columns they are ignored
+    nRows, nCols = np.shape(mat)
+    rows = range(min(nRows, nCols-1))
+    out = np.empty(sum([nCols-i-1 for i in rows]), dtype=mat.dtype)
+    start = 0
+    for i in rows:
+        out[start:start+nCols-i-1] = mat[i,i+1:]
+        start += nCols-i-1
+    return out
+        
+def packIndex(i, j, n):
+    '''
+    Get the position of element i,j of an n x n symmetric matrix in its packed
+    upper triangle, an array of the values above the diagonal row by row as
+    given by undirectedFlatten. Works on arrays of indices as well as single
+    values, i and j must not be equal.
+    '''
     
-    s = np.shape(mat)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return i*(2*n-i-1)//2 + j - i - 1
+
+def unpackIndex(k, n):
+    ''' get the row and column for positions k in the packed upper triangle of an n x n matrix '''
+    
+    k = np.asarray(k)
+    i = n - 2 - np.floor(np.sqrt(-8*k + 4*n*(n-1) - 7)/2. - 0.5).astype(int)
+    j = k + i + 1 - n*(n-1)//2 + (n-i)*((n-i)-1)//2
+    return i, j
+
+def packedSize(packed):
+    ''' get the number of nodes, n, of a packed upper triangle '''
     
-    flatMat = []
+    return int(round((1 + np.sqrt(1 + 8*len(packed))) / 2.))
+
+def unpackTriangle(packed, out=None):
+    ''' make a full symmetric matrix, of the same type as the packed upper triangle, the diagonal is NaN '''
     
-    # flatten the upper right section
-    for rows in range(s[0]):
+    n = packedSize(packed)
+    if out is None:
+        out = np.empty((n,n), dtype=packed.dtype)
+    out[:] = np.nan
+    
+    for i in range(n-1):
+        start = packIndex(i, i+1, n)
+        out[i,i+1:] = packed[start:start+n-i-1]
+        out[i+1:,i] = packed[start:start+n-i-1]
+    
+    return out
+
+def findDataStart(lines):
+    ''' get the line that data starts in from a "data begins line n" header,
+        returns 0 if there is no header '''
+
+    for line in lines:
+        lstr = str(line)
+        whereLabel = lstr.find('begins line')
+        if whereLabel != -1:
+            return int(lstr[whereLabel + 11:].split()[0]) - 1
+
+    return 0
+
+def countColumns(line, delimiter=None):
+    ''' count the number of values in a line of an association matrix '''
+
+    return len(line.rstrip('\r\n\t').split(delimiter))
+
+def readAdjLines(fname):
+    ''' get the lines of data from an association matrix file, leaving out any header and blank lines '''
+
+    f = open(fname,"rb")
+    reader = f.read().splitlines()
+    f.close()
+
+    # get line that data starts in
+    startLine = findDataStart(reader)
+
+    return [l for l in reader[startLine:] if l.strip()]
+
+def readAdjFile(fname, delimiter=None, naVals=["NA"], dtype="float64"):
+    ''' read an association matrix file in to an array of type dtype, values in naVals become NaN '''
+
+    lines = readAdjLines(fname)
+    out = np.empty((len(lines), countColumns(lines[0], delimiter)), dtype=dtype)
+
+    return parseAdjLines(lines, out, delimiter=delimiter, naVals=naVals)
+
+def adjFileShape(fname, delimiter=None):
+    '''
+    Scan an association matrix file line by line without holding it in
+    memory. Returns the line the data starts in and the number of rows and
+    columns of the matrix.
+    '''
+
+    f = open(fname, "rb")
+
+    # get line that data starts in and the non-blank lines
+    startLine = None
+    dataLines = []
+    for n,line in enumerate(f):
+        if startLine is None and 'begins line' in line:
+            startLine = findDataStart([line])
+        if line.strip():
+            dataLines.append(n)
+
+    if startLine is None:
+        startLine = 0
+    dataLines = [n for n in dataLines if n >= startLine]
+
+    # count columns from the first row of data
+    nCols = 0
+    if dataLines:
+        f.seek(0)
+        for n,line in enumerate(f):
+            if n == dataLines[0]:
+                nCols = countColumns(line, delimiter)
+                break
+    f.close()
+
+    return startLine, len(dataLines), nCols
+
+def readAdjBlocks(fname, startLine=0, blockSize=1000):
+    ''' generator giving lists of up to blockSize non-blank lines of data from a file '''
+
+    f = open(fname, "rb")
+    block = []
+    for n,line in enumerate(f):
+        if n < startLine or not line.strip():
+            continue
+        block.append(line)
+        if len(block) == blockSize:
+            yield block
+            block = []
+    f.close()
+
+    if block:
+        yield block
+
+def parseAdjLines(lines, out, delimiter=None, naVals=["NA"], firstRow=0):
+    '''
+    Parse a list of text lines from an association matrix in to the rows of
+    a preallocated array, out. All values are converted to the type of out in
+    one go rather than value by value, values in naVals become NaN. Each line
+    must have a value for every column of out, firstRow is the row of the
+    matrix the first line holds, to say which row is wrong if not.
+    '''
+
+    # split each line, checking it has a value for every column
+    if delimiter:
+        rows = [l.rstrip('\r\n\t').split(delimiter) for l in lines]
+    else:
+        rows = [l.split() for l in lines]
+    for n,row in enumerate(rows):
+        if len(row) != out.shape[1]:
+            raise ValueError('row ' + str(firstRow+n) + ' of the association matrix has ' + str(len(row)) + ' values, not ' + str(out.shape[1]))
+    tokens = np.array(rows).reshape(-1)
+
+    if len(tokens) != out.size:
+        raise ValueError('association matrix has ' + str(len(rows)) + ' rows, not ' + str(out.shape[0]))
+
+    # find missing values, these are set to 0 for conversion then replaced
+    naMask = np.zeros(len(tokens), dtype=bool)
+    for na in naVals:
+        naMask |= tokens==na
+    tokens[naMask] = '0'
+
+    out[:] = tokens.astype(out.dtype).reshape(out.shape)
+    out[naMask.reshape(out.shape)] = np.nan
+
+    return out
+
+def edgeKeys(i, j, directed=False):
+    '''
+    Give each edge from i to j, which can be arrays, a single integer key. For
+    undirected edges i to j and j to i have the same key.
+    '''
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    if not directed:
+        i, j = np.minimum(i, j), np.maximum(i, j)
+    return (i << 32) + j
+
+def nearestPoints(a, b, blockSize=1000):
+    '''
+    For each row of a, an array of coordinates, find the nearest row of b.
+    Returns the positions of the nearest rows in b and the distances to them.
+    The distances are found blockSize rows of a at a time.
+    '''
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    nearest = np.zeros(len(a), dtype=int)
+    dists = np.zeros(len(a))
+    for start in range(0, len(a), blockSize):
+        d = np.sqrt(np.sum((a[start:start+blockSize,np.newaxis,:] - b[np.newaxis,:,:])**2, axis=2))
+        nearest[start:start+len(d)] = np.argmin(d, axis=1)
+        dists[start:start+len(d)] = d[np.arange(len(d)), nearest[start:start+len(d)]]
+    return nearest, dists
+
+def edgePositions(edges, nodeIndices):
+    ''' convert a list of edges to an Ex2 array of positions, using a dictionary of node positions '''
+
+    return np.array([[nodeIndices[e[0]], nodeIndices[e[1]]] for e in edges], dtype=int).reshape((len(edges),2))
+
+def typedColumn(vals, naVals=["NA"]):
+    '''
+    Convert an array of strings to integers, floats or strings, whichever
+    fits all the values. Values in naVals become NaN (so the column can't be
+    integers). Strings are returned as a categorical column (see
+    columns.categorical), with values in naVals missing.
+    '''
+    
+    vals = np.array(vals)
+    naMask = np.zeros(len(vals), dtype=bool)
+    for na in naVals:
+        naMask |= vals==na
+    
+    if not np.any(naMask):
         try:
-            flatMat = flatMat + list(mat[rows,rows+1:])
-        except:
-            # case where there's more rows than columns, just ignore
+            return vals.astype(int)
+        except ValueError:
             pass
-        
-    return flatMat
-        
+    
+    try:
+        out = np.where(naMask, '0', vals).astype(float)
+        out[naMask] = np.nan
+        return out
+    except ValueError:
+        return columns.categorical(vals, missing=naMask)
+
+def propertyColumns(dicts, skip=[]):
+    '''
+    Gather the properties from a list of node or edge dictionaries in to
+    typed columns. Returns a dictionary of property names with an array of
+    positions in the list and an array of values. Properties that are not
+    numbers or strings, e.g. lists, are left out.
+    '''
+
+    cols = {}
+    for n,d in enumerate(dicts):
+        for prop,val in d.iteritems():
+            if prop in skip:
+                continue
+            if not prop in cols:
+                cols[prop] = ([],[])
+            cols[prop][0].append(n)
+            cols[prop][1].append(val)
+
+    out = {}
+    for prop,(inds,vals) in cols.iteritems():
+        vals = np.array(vals)
+        if vals.ndim==1 and vals.dtype.kind in 'biufSU':
+            out[prop] = (np.array(inds, dtype=int), vals)
+
+    return out
 
 def stripString(strIn):
     ''' remove unwanted characters from beginning and end of a string '''
@@ -546,8 +964,4 @@ def stripString(strIn):
             return ''
             
     return strOut
-        
-    
-    
-    
-    return np.array(flatMat)
+
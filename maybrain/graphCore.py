@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+A compact graph held as arrays rather than networkx dictionaries.
+
+Edges are kept as arrays of start nodes, end nodes and weights, with the
+neighbours of each node in compressed sparse row (CSR) form, so there are no
+per-edge objects and measures over all nodes or edges are numpy operations.
+Nodes are integers, the row and column indices of the adjacency matrix.
+
+"""
+
+import numpy as np
+
+
+class csrGraph:
+    """
+    A graph of nNodes possible nodes with edge k from i[k] to j[k] with weight
+    w[k]. Undirected edges are stored once but appear in the neighbours of
+    both of their nodes.
+
+    indptr, indices and edgeIds are the CSR neighbour lists: the neighbours of
+    node v are indices[indptr[v]:indptr[v+1]], joined to it by the edges
+    edgeIds[indptr[v]:indptr[v+1]]. For directed graphs these are successors.
+    """
+
+    def __init__(self, nNodes, i, j, w, directed=False, nodes=None):
+        '''
+        nodes lists the nodes in the graph, by default all of range(nNodes).
+        '''
+        self.nNodes = nNodes
+        self.directed = directed
+        self.i = np.asarray(i, dtype=int)
+        self.j = np.asarray(j, dtype=int)
+        self.w = np.asarray(w)
+
+        self.present = np.zeros(nNodes, dtype=bool) # nodes in the graph
+        if nodes is None:
+            self.present[:] = True
+        else:
+            self.present[np.asarray(nodes, dtype=int)] = True
+
+        # neighbour lists, undirected edges are added in both directions
+        e = np.arange(len(self.i))
+        if self.directed:
+            src, dst = self.i, self.j
+        else:
+            src, dst, e = np.concatenate((self.i, self.j)), np.concatenate((self.j, self.i)), np.concatenate((e, e))
+
+        order = np.argsort(src, kind='mergesort')
+        self.indptr = np.zeros(nNodes+1, dtype=int)
+        self.indptr[1:] = np.cumsum(np.bincount(src, minlength=nNodes))
+        self.indices = dst[order]
+        self.edgeIds = e[order]
+
+    def nodes(self):
+        ''' array of the nodes in the graph '''
+        return np.where(self.present)[0]
+
+    def numberOfNodes(self):
+        return int(np.count_nonzero(self.present))
+
+    def numberOfEdges(self):
+        return len(self.i)
+
+    def edges(self):
+        ''' the edges as arrays of start nodes, end nodes and weights '''
+        return self.i, self.j, self.w
+
+    def neighbours(self, v):
+        ''' the neighbours of node v and the weights of the edges to them '''
+        s = slice(self.indptr[v], self.indptr[v+1])
+        return self.indices[s], self.w[self.edgeIds[s]]
+
+    def hasEdge(self, a, b):
+        return b in self.indices[self.indptr[a]:self.indptr[a+1]]
+
+    def degree(self, weighted=False):
+        '''
+        Array of the degree of every node, or the sum of its edge weights if
+        weighted. For directed graphs this is the in plus the out degree, as
+        for networkx.
+        '''
+        if weighted:
+            w = self.w.astype(float)
+        else:
+            w = None
+        return np.bincount(self.i, weights=w, minlength=self.nNodes) + np.bincount(self.j, weights=w, minlength=self.nNodes)
+
+    def edgeLengths(self, xyz):
+        ''' array of the length of each edge, xyz is an array with row n for node n '''
+        return np.sqrt(np.sum((xyz[self.i] - xyz[self.j])**2, axis=1))
+
+    def withinModuleDegree(self, ci, weighted=False):
+        '''
+        Array of the number of edges of each node to nodes in the same module,
+        or the mean weight of those edges if weighted. ci is an array of the
+        module of each node. For directed graphs only out edges are counted.
+        '''
+        same = ci[self.i] == ci[self.j]
+        i, j, w = self.i[same], self.j[same], self.w[same].astype(float)
+
+        counts = np.bincount(i, minlength=self.nNodes)
+        if not self.directed:
+            counts += np.bincount(j, minlength=self.nNodes)
+        if not weighted:
+            return counts.astype(float)
+
+        wts = np.bincount(i, weights=w, minlength=self.nNodes)
+        if not self.directed:
+            wts += np.bincount(j, weights=w, minlength=self.nNodes)
+        with np.errstate(invalid='ignore'):
+            return wts / counts
+
+    def distances(self, weighted=False, sources=None):
+        '''
+        Matrix of the shortest path lengths between every pair of nodes, inf
+        where there is no path. Path lengths are numbers of edges, or the sum
+        of the edge weights if weighted. Paths from all nodes are found at once
+        by scipy's Dijkstra, which for unit lengths is a breadth first search.
+        If sources is given, only the rows for those nodes are found. Negative
+        weights raise a ValueError, as in networkx, because Dijkstra's paths
+        are meaningless with them.
+        '''
+        from scipy.sparse import csgraph, csr_matrix
+        
+        if weighted and np.any(self.w < 0):
+            raise ValueError('shortest paths can not be found with negative edge weights')
+        
+        S = csr_matrix((self.w.astype(float), (self.i, self.j)), shape=(self.nNodes, self.nNodes))
+        return csgraph.shortest_path(S, method='D', directed=self.directed, unweighted=not weighted, indices=sources)
+
+    def toGraph(self, G, weight='weight'):
+        ''' add the edges to the networkx graph G, with their weights '''
+        G.add_weighted_edges_from(zip(self.i.tolist(), self.j.tolist(), self.w.tolist()), weight=weight)
+        return G
+
+
+def fromGraph(G, nNodes=None, weight='weight'):
+    '''
+    Make a csrGraph from the networkx graph G, whose nodes must be integers.
+    Edges without a weight have a weight of 1, as in networkx.
+    '''
+    nodes = np.array(G.nodes(), dtype=int)
+    edges = G.edges(data=True)
+    if nNodes is None:
+        nNodes = np.max(nodes) + 1 if len(nodes) else 0
+
+    i = np.array([e[0] for e in edges], dtype=int)
+    j = np.array([e[1] for e in edges], dtype=int)
+    w = np.array([e[2].get(weight, 1.) for e in edges], dtype=float)
+
+    return csrGraph(nNodes, i, j, w, directed=G.is_directed(), nodes=nodes)
@@ -105,34 +105,16 @@ class plotObj():
     def edgesToList(self, brain):
         ''' Turn the edges of a brain into coordinates '''
                 
-        # intialise output
-        x1 = []
-        x2 = []
+        edges = brain.G.edges(data = True)
         
-        y1 = []
-        y2 = []
+        # get coord and vector from each edge, reading the coordinates as arrays
+        p1 = brain.nodeCoords([e[0] for e in edges])
+        p2 = brain.nodeCoords([e[1] for e in edges])
+        x1, y1, z1 = p1.T
+        x2, y2, z2 = (p2 - p1).T
         
-        z1 = []
-        z2 = []
-        
-        s = []
-        
-        for e in brain.G.edges(data = True):
-            # get coord and vector from each edge
-            p1 = brain.G.node[e[0]]['xyz']
-            p2 = brain.G.node[e[1]]['xyz']
-            
-            x1.append(p1[0])
-            x2.append(p2[0]-p1[0]) 
-            
-            y1.append(p1[1])
-            y2.append(p2[1]-p1[1])
-            
-            z1.append(p1[2])
-            z2.append(p2[2]-p1[2])
-            
-            # set scalar value as edge weight
-            s.append(e[2]['weight'])
+        # set scalar value as edge weight
+        s = [e[2]['weight'] for e in edges]
         
         return x1, y1, z1, x2, y2, z2, s
 
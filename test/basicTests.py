@@ -12,7 +12,11 @@ try:
 except:
     pass
 
+import os
+import shutil
 import unittest
+import numpy as np
+import networkx as nx
 import maybrain as mb
 from maybrain import recipes
 
@@ -34,6 +38,176 @@ class TestSequenceFunctions(unittest.TestCase):
         self.brain.importAdjFile(self.fnameAdj)
         
     
+    def test_loadAdjHeaderNA(self):
+        ''' test loading with a header line, delimiter and NA values '''
+
+        fname = 'data/temp_adj.txt'
+        f = open(fname, 'w')
+        f.write('data begins line 2\n0.1,NA,0.3\n0.4,0.5,0.6\nNA,0.8,0.9\n')
+        f.close()
+
+        self.brain.importAdjFile(fname, delimiter=',', exclnodes=[2])
+        os.remove(fname)
+
+        self.assertEqual(self.brain.adjMat.shape, (3,3))
+        self.assertEqual(self.brain.adjMat[1,0], 0.4)
+        self.assertTrue(np.isnan(self.brain.adjMat[0,1]))
+        self.assertTrue(np.all(np.isnan(self.brain.adjMat[2,:])))
+        self.assertEqual(self.brain.G.nodes(), [0,1])
+
+    def test_loadAdjBlocks(self):
+        ''' test streaming the adjacency matrix in blocks gives the same matrix '''
+
+        self.brain.importAdjFile(self.fnameAdj, exclnodes=[1])
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj, exclnodes=[1], blockSize=3)
+
+        np.testing.assert_array_equal(self.brain.adjMat, br.adjMat)
+        self.assertEqual(self.brain.G.nodes(), br.G.nodes())
+
+
+    def test_loadEdgeList(self):
+        ''' load a weighted edge list and threshold it without a dense matrix '''
+
+        fname = 'data/temp_edges.txt'
+        f = open(fname, 'w')
+        f.write('0 1 0.9\n1 2 0.4\n0 3 0.6\n')
+        f.close()
+
+        self.brain.importEdgeList(fname, nNodes=5)
+        os.remove(fname)
+
+        self.assertTrue(self.brain.adjMat is None)
+        self.assertEqual(len(self.brain.G.nodes()), 5)
+        self.assertEqual(len(self.brain.G.edges()), 3)
+
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        self.assertEqual(sorted(self.brain.G.edges()), [(0,1), (0,3)])
+
+        self.assertEqual(self.brain.getAdjMat()[3,0], 0.6)
+
+    def test_loadAdjPacked(self):
+        ''' test a packed upper triangle thresholds the same as the full matrix '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = 50)
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj, packed=True, blockSize=2)
+        br.applyThreshold(thresholdType = 'edgePC', value = 50)
+
+        self.assertTrue(br.adjMat is None)
+        self.assertEqual(len(br.packedAdj), 6)
+        self.assertEqual(sorted(self.brain.G.edges(data=True)), sorted(br.G.edges(data=True)))
+
+    def test_loadAdjDtype(self):
+        ''' test the adjacency matrix and its copies keep the brain's dtype '''
+
+        br = mb.brainObj(dtype="float32")
+        br.importAdjFile(self.fnameAdj, packed=True)
+        self.assertEqual(br.packedAdj.dtype, np.float32)
+        self.assertEqual(br.getAdjMat().dtype, np.float32)
+
+        br.applyThreshold(thresholdType = 'edgePC', value = 50)
+        br.reconstructAdjMat()
+        br.makebctmat()
+        self.assertEqual(br.adjMat.dtype, np.float32)
+        self.assertEqual(br.bctmat.dtype, np.float32)
+
+    #### native format
+    def test_exportImportBrain(self):
+        ''' save a thresholded brain in the native format and open it again '''
+
+        br = recipes.loadAndThreshold(self.fnameAdj, self.fnameCo, 0.5)
+        br.importProperties(self.fnameProp)
+        br.exportBrain('data/temp_brain')
+
+        br2 = mb.brainObj()
+        br2.importBrain('data/temp_brain', mmapMode='r')
+        shutil.rmtree('data/temp_brain')
+
+        np.testing.assert_array_equal(br.adjMat, br2.adjMat)
+        self.assertEqual(br.threshold, br2.threshold)
+        self.assertEqual(sorted(br.G.edges(data=True)), sorted(br2.G.edges(data=True)))
+        np.testing.assert_array_equal(br.nodeCoords(br.G.nodes()), br2.nodeCoords(br2.G.nodes()))
+        self.assertEqual([br.G.node[v]['anatlabel'] for v in br.G.nodes()],
+                         [br2.G.node[v]['anatlabel'] for v in br2.G.nodes()])
+
+
+    def test_snapshotRestore(self):
+        ''' snapshot a brain with highlights and at risk edges and restore it '''
+
+        br = recipes.loadAndThreshold(self.fnameAdj, self.fnameCo, 0.5)
+        br.highlightFromConds('x', 'gt', 0.5, label = 'x1', mode = 'node')
+        br.riskEdges = br.G.edges()[:1]
+        br.snapshot('data/temp_snapshot.npz')
+
+        br2 = mb.brainObj()
+        br2.restore('data/temp_snapshot.npz')
+        os.remove('data/temp_snapshot.npz')
+
+        self.assertEqual(sorted(br.G.edges(data=True)), sorted(br2.G.edges(data=True)))
+        self.assertEqual(br.riskEdges, br2.riskEdges)
+        self.assertEqual(br.highlights['x1'].nodeIndices, br2.highlights['x1'].nodeIndices)
+
+    def test_spatialInfo(self):
+        ''' test coordinates are held as an array with xyz views on each node '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.importSpatialInfo(self.fnameCo, convertMNI=True)
+
+        self.assertEqual(self.brain.coords.shape, (9,3))
+        np.testing.assert_array_equal(self.brain.coords[1], [44., 63., 36.])
+        self.brain.coords[1,0] = 0.
+        self.assertEqual(self.brain.G.node[1]['xyz'][0], 0.)
+
+    def test_importPropertyTable(self):
+        ''' add several typed node properties from one file and highlight from them '''
+
+        fname = 'data/temp_props.txt'
+        f = open(fname, 'w')
+        f.write('node thickness module label\n0 2.5 1 frontal\n2 2.7 2 parietal\n1 NA 1 frontal\n')
+        f.close()
+
+        self.brain.importAdjFile(self.fnameAdj)
+        props = self.brain.importPropertyTable(fname)
+        os.remove(fname)
+
+        self.assertEqual(props, ['thickness', 'module', 'label'])
+        self.assertTrue(np.isnan(self.brain.nodeProps['thickness'][1]))
+        self.assertEqual(self.brain.nodeProps['label'][2], 'parietal')
+
+        self.brain.highlightFromConds('module', 'eq', 1, label = 'm1', mode = 'node')
+        self.assertEqual(self.brain.highlights['m1'].nodeIndices, [0,1])
+
+    def test_edgePropertyTable(self):
+        ''' edge properties from a table are columns that survive saving the brain '''
+
+        fname = 'data/temp_props.txt'
+        f = open(fname, 'w')
+        f.write('node1 node2 length tract\n0 1 2.5 arcuate\n3 2 NA cingulum\n1 0 3.0 arcuate\n')
+        f.close()
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold()
+        self.brain.importPropertyTable(fname, edges=True)
+        os.remove(fname)
+
+        vals, has = self.brain.edgePropertyArray('length', [(1,0), (2,3), (0,2)])
+        self.assertEqual(has.tolist(), [True, True, False])
+        self.assertEqual(vals[0], 3.0)
+        self.assertTrue(isinstance(self.brain.edgeProps['tract'][1], mb.columns.categorical))
+
+        self.brain.highlightFromConds('tract', 'eq', 'cingulum', label = 'c1', mode = 'edge')
+        self.assertEqual(self.brain.highlights['c1'].edgeIndices, [(2,3)])
+
+        self.brain.exportBrain('data/temp_brain')
+        br = mb.brainObj()
+        br.importBrain('data/temp_brain')
+        shutil.rmtree('data/temp_brain')
+        self.assertEqual(br.edgePropertyArray('tract', [(3,2)])[0][0], 'cingulum')
+
     #### Different types of thresholding
     def test_loadAndThresholdVal(self):
         ''' load files and threshold '''
@@ -50,6 +224,583 @@ class TestSequenceFunctions(unittest.TestCase):
         # threshold by number of edges
         self.brain.applyThreshold(totalEdges = 2)
         
+    def test_sortedWeightIndex(self):
+        ''' repeated thresholds use the sorted weights until the matrix changes '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        self.assertTrue(self.brain.weightIndex is None)
+        t = self.brain.threshold
+
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = 50)
+        np.testing.assert_array_equal(self.brain.weightIndex, np.sort(self.brain.edgeWeights()))
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        self.assertEqual(self.brain.threshold, t)
+
+        self.brain.G.remove_edge(*self.brain.G.edges()[0])
+        self.brain.reconstructAdjMat()
+        self.assertTrue(self.brain.weightIndex is None)
+
+    def test_edgeJournal(self):
+        ''' logged edge changes update the matrix and the sorted weights in place '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = 50)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        v = self.brain.graphVersion
+
+        a, b = self.brain.G.edges()[0]
+        self.brain.G.remove_edge(a, b)
+        self.brain.logEdge((a, b))
+        self.assertFalse(np.isnan(self.brain.adjMat[a,b]))
+        self.brain.syncAdjMat()
+
+        self.assertTrue(np.isnan(self.brain.adjMat[a,b]) and np.isnan(self.brain.adjMat[b,a]))
+        self.assertEqual(self.brain.weightIndexKey, self.brain.adjKey())
+        np.testing.assert_array_equal(self.brain.weightIndex, np.sort(self.brain.edgeWeights()))
+        self.assertTrue(self.brain.graphVersion > v)
+
+    def test_thresholdSweep(self):
+        ''' a sweep of densities gives the same graphs as thresholding at each one '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj)
+
+        for pc,G in self.brain.thresholdSweep([20, 50, 100]):
+            br.applyThreshold(thresholdType = 'edgePC', value = pc)
+            self.assertEqual(sorted(G.edges(data=True)), sorted(br.G.edges(data=True)))
+
+        table = self.brain.sweepMetrics([50, 20], {'edges':lambda G: len(G.edges())})
+        np.testing.assert_array_equal(table.density, [20., 50.])
+        np.testing.assert_array_equal(table.edges, [1., 3.])
+
+    def test_checkRobustness(self):
+        ''' the robustness density is the lowest density with a connected graph '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        pc = self.brain.checkrobustness()
+        densities, nComps = self.brain.robustnessCurve
+        self.assertEqual(list(nComps), [4, 3, 2, 1])
+        self.assertEqual(pc, densities[-1])
+
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = pc)
+        self.assertEqual(nx.number_connected_components(self.brain.G), 1)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = len(self.brain.G.edges())-1)
+        self.assertEqual(nx.number_connected_components(self.brain.G), 2)
+
+    def test_localThresholding(self):
+        ''' local thresholding grows the spanning tree with nearest neighbour edges '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        nbrs, weights = self.brain.nearestNeighbours(2)
+        self.assertEqual(nbrs.shape, (4,2))
+        self.assertTrue(np.all(weights[:,0] >= weights[:,1]))
+
+        self.brain.localThresholding(totalEdges=5)
+        self.assertEqual(len(self.brain.G.edges()), 5)
+        for e in self.brain.NNG(1).edges():
+            self.assertTrue(self.brain.G.has_edge(*e))
+
+    def test_spanningTree(self):
+        ''' the spanning tree from the adjacency matrix matches the networkx one '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold()
+        T = self.brain.minimum_spanning_tree()
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj, packed=True)
+        i, j, w = br.spanningTree(makeGraph=True)
+
+        self.assertEqual(len(w), 3)
+        self.assertEqual(sorted([tuple(sorted(e)) for e in T.edges()]), sorted(br.G.edges()))
+
+    def test_blockThreshold(self):
+        ''' thresholding a memmap in blocks gives the same edges as the whole matrix '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = 50)
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj, mmapFile='data/temp_adj.dat')
+        br.applyThreshold(thresholdType = 'edgePC', value = 50, blockSize=1)
+        pc = br.thresholdToPercentage(0.5, blockSize=3)
+        del(br.adjMat)
+        os.remove('data/temp_adj.dat')
+
+        self.assertEqual(br.threshold, self.brain.threshold)
+        self.assertEqual(sorted(br.G.edges(data=True)), sorted(self.brain.G.edges(data=True)))
+        self.assertEqual(pc, self.brain.thresholdToPercentage(0.5))
+
+    def test_thresholdToPercentage(self):
+        ''' percentage connectivity is the same from full, packed and sparse matrices and the sorted weights '''
+
+        # the diagonal is left out, undirected edges are taken from the upper triangle
+        adjMat = np.loadtxt(self.fnameAdj)
+        brains = []
+        for directed in [False, True]:
+            full = mb.brainObj(directed=directed)
+            full.importAdjFile(self.fnameAdj)
+
+            # an undirected edge list has each edge once
+            with open('data/temp_edges.txt', 'w') as f:
+                for i,j in zip(*np.where(np.ones((4,4)) if directed else np.triu(np.ones((4,4))))):
+                    f.write(' '.join([str(i), str(j), repr(adjMat[i,j])]) + '\n')
+            sparse = mb.brainObj(directed=directed)
+            sparse.importEdgeList('data/temp_edges.txt')
+            brains.append([full, sparse])
+        packed = mb.brainObj()
+        packed.importAdjFile(self.fnameAdj, packed=True)
+        brains[0].append(packed)
+        os.remove('data/temp_edges.txt')
+
+        for brs,nAbove in zip(brains, [6, 7]):
+            for br in brs:
+                self.assertEqual(br.edgesAbove(0.5), nAbove)
+                self.assertEqual(br.thresholdToPercentage(0.5), nAbove/12.)
+                br.sortedWeights()
+                self.assertEqual(br.edgesAbove(0.5), nAbove)
+                self.assertEqual(br.thresholdToPercentage(0.5), nAbove/12.)
+
+    def test_rethreshold(self):
+        ''' rethreshold only changes the edges that differ, keeping their attributes '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        e = self.brain.G.edges()[0]
+        self.brain.G.edge[e[0]][e[1]]['colour'] = 'green'
+
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 4, rethreshold=True)
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 4)
+
+        self.assertEqual(sorted(self.brain.G.edges()), sorted(br.G.edges()))
+        self.assertEqual(self.brain.G.edge[e[0]][e[1]]['colour'], 'green')
+
+    def test_graphCore(self):
+        ''' edges kept as an array graph give the same G when it is used '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+
+        br = mb.brainObj(core=True)
+        br.importAdjFile(self.fnameAdj)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 3)
+
+        self.assertTrue(br.coreCurrent())
+        self.assertEqual(br.percentConnected(), self.brain.percentConnected())
+        np.testing.assert_array_equal(br.core.degree(), [self.brain.G.degree(v) for v in range(4)])
+        ci = {0:1, 1:1, 2:2, 3:2}
+        np.testing.assert_array_equal(mb.withinModuleDegree(br.core, np.array([1,1,2,2])),
+                                      [mb.withinModuleDegree(self.brain.G, ci)[v] for v in range(4)])
+
+        self.assertEqual(sorted(br.G.edges(data=True)), sorted(self.brain.G.edges(data=True)))
+        self.assertFalse(br.coreCurrent())
+
+    def test_fork(self):
+        ''' a fork shares the matrix until it changes it and leaves the original alone '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+        edges = sorted(self.brain.G.edges(data=True))
+        adjMat = self.brain.adjMat.copy()
+
+        br = self.brain.fork()
+        self.assertTrue(np.may_share_memory(br.adjMat, self.brain.adjMat))
+        self.assertEqual(sorted(br.G.edges(data=True)), edges)
+
+        a, b = br.G.edges()[0]
+        br.G.remove_edge(a, b)
+        br.updateAdjMat((a, b))
+
+        self.assertTrue(np.isnan(br.adjMat[a,b]))
+        np.testing.assert_array_equal(self.brain.adjMat, adjMat)
+        self.assertEqual(sorted(self.brain.G.edges(data=True)), edges)
+
+    def test_pathLengths(self):
+        ''' efficiencies from shared path lengths match those from networkx paths '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+        G = self.brain.G
+
+        paths = self.brain.pathLengths()
+        self.assertTrue(self.brain.pathLengths() is paths)
+        nodes, D = paths
+        for n,v in enumerate(nodes):
+            pls = nx.shortest_path_length(G, source=v)
+            self.assertEqual([pls.get(u, np.inf) for u in nodes], D[n].tolist())
+
+        effs = [mb.efficiencyfunc(v, G) for v in nodes]
+        self.assertAlmostEqual(mb.globalefficiency(G, paths=paths), np.sum(effs) / 12.)
+        nodEff = mb.nodalefficiency(G, paths=paths)
+        for v,e in zip(nodes, effs):
+            self.assertAlmostEqual(nodEff[v], e / 12.)
+
+        wEffs = [mb.efficiencyfunc(v, G, weight='weight') for v in nodes]
+        self.assertAlmostEqual(mb.globalefficiency(G, paths=self.brain.pathLengths('weight')), np.sum(wEffs) / 12.)
+
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 4)
+        self.assertFalse(self.brain.pathLengths() is paths)
+
+    def test_exportBrainStale(self):
+        ''' exporting again over a saved brain doesn't leave its old arrays '''
+
+        br = recipes.loadAndThreshold(self.fnameAdj, self.fnameCo, 0.5)
+        br.exportBrain('data/temp_brain')
+        br.adjMat = None
+        br.exportBrain('data/temp_brain')
+
+        br2 = mb.brainObj()
+        br2.importBrain('data/temp_brain')
+        shutil.rmtree('data/temp_brain')
+
+        self.assertTrue(br2.adjMat is None)
+        self.assertEqual(sorted(br.G.edges(data=True)), sorted(br2.G.edges(data=True)))
+
+    def test_missingStrings(self):
+        ''' missing string properties don't match any string, not even '' '''
+
+        fname = 'data/temp_props.txt'
+        f = open(fname, 'w')
+        f.write('node label\n0 frontal\n1 NA\n')
+        f.close()
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.importPropertyTable(fname)
+
+        f = open(fname, 'w')
+        f.write('node1 node2 tract\n0 1 arcuate\n2 3 NA\n')
+        f.close()
+        self.brain.applyThreshold()
+        self.brain.importPropertyTable(fname, edges=True)
+        self.brain.importPropertyTable(fname, edges=True)
+        os.remove(fname)
+
+        self.assertEqual(self.brain.nodeProps['label'].decode().tolist(), ['frontal', '', '', ''])
+        self.brain.highlightFromConds('label', 'eq', '', label = 'n1', mode = 'node')
+        self.assertEqual(self.brain.highlights['n1'].nodeIndices, [])
+
+        vals, has = self.brain.edgePropertyArray('tract', [(0,1), (2,3)])
+        self.assertEqual(has.tolist(), [True, False])
+        self.brain.highlightFromConds('tract', 'eq', '', label = 'e1', mode = 'edge')
+        self.assertEqual(self.brain.highlights['e1'].edgeIndices, [])
+
+    def test_rethresholdWeights(self):
+        ''' rethreshold updates the weights of kept edges, with any node labels '''
+
+        br = self.brain
+        br.importAdjFile(self.fnameAdj)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        a, b = br.G.edges()[0]
+        br.G.edge[a][b]['colour'] = 'green'
+
+        br.adjMat = br.adjMat * 2
+        br.adjMatChanged()
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2, rethreshold=True)
+
+        self.assertEqual(br.G.edge[a][b]['weight'], br.adjMat[a,b])
+        self.assertEqual(br.G.edge[a][b]['colour'], 'green')
+
+        br.G.add_edge('a', 'b')
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2, rethreshold=True)
+        self.assertFalse(br.G.has_edge('a', 'b'))
+        self.assertEqual(len(br.G.edges()), 2)
+
+    def test_checkRobustnessTies(self):
+        ''' the robustness density allows for edges tied with the threshold '''
+
+        self.brain.adjMat = np.array([[np.nan, 0.9, 0.5, 0.1],
+                                      [0.9, np.nan, 0.1, 0.1],
+                                      [0.5, 0.1, np.nan, 0.5],
+                                      [0.1, 0.1, 0.5, np.nan]])
+        self.brain.G.add_nodes_from(range(4))
+        self.brain.adjMatChanged()
+
+        pc = self.brain.checkrobustness()
+        self.assertEqual(list(self.brain.robustnessCurve[1]), [4, 3, 2, 1])
+
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = pc)
+        self.assertEqual(nx.number_connected_components(self.brain.G), 1)
+        self.brain.applyThreshold(thresholdType = 'edgePC', value = np.nextafter(pc, 0))
+        self.assertEqual(nx.number_connected_components(self.brain.G), 3)
+
+    def test_graphCoreRethreshold(self):
+        ''' rethreshold keeps edge attributes when G has been made from the array graph '''
+
+        br = mb.brainObj(core=True)
+        br.importAdjFile(self.fnameAdj)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        a, b = br.G.edges()[0]
+        br.G.edge[a][b]['colour'] = 'green'
+
+        br.applyThreshold(thresholdType = 'totalEdges', value = 3, rethreshold=True)
+        self.assertEqual(len(br.G.edges()), 3)
+        self.assertEqual(br.G.edge[a][b]['colour'], 'green')
+
+    def test_withinModuleDegree(self):
+        ''' within module degree with weight=True and with nodes that aren't integers '''
+
+        G = nx.Graph()
+        G.add_weighted_edges_from([(0,1,0.2), (0,2,0.5), (1,2,0.8), (2,3,0.1)])
+        ci = {0:1, 1:1, 2:1, 3:2}
+        wmd = mb.withinModuleDegree(G, ci, weight=True)
+        for v,w in [(0,0.35), (1,0.5), (2,0.65)]:
+            self.assertAlmostEqual(wmd[v], w)
+
+        H = nx.relabel_nodes(G, dict((v,'n'+str(v)) for v in G.nodes()))
+        wmd = mb.withinModuleDegree(H, dict(('n'+str(v),m) for v,m in ci.items()))
+        self.assertEqual(wmd, {'n0':2., 'n1':2., 'n2':2., 'n3':0.})
+
+    def test_sparseJournal(self):
+        ''' logged edge changes are written in to a sparse matrix in place '''
+
+        fname = 'data/temp_edges.txt'
+        f = open(fname, 'w')
+        f.write('0 1 0.9\n1 2 0.4\n0 3 0.6\n')
+        f.close()
+
+        self.brain.importEdgeList(fname, nNodes=5)
+        os.remove(fname)
+        S = self.brain.sparseAdj
+
+        self.brain.G.remove_edge(0, 3)
+        self.brain.logEdge((3, 0))
+        self.brain.G.edge[1][2]['weight'] = 0.5
+        self.brain.logEdge((1, 2))
+        self.brain.syncAdjMat()
+
+        self.assertTrue(self.brain.sparseAdj is S)
+        self.assertTrue(np.all(np.isnan(self.brain.adjValues(np.array([0,3]), np.array([3,0])))))
+        self.assertEqual(self.brain.adjValues(np.array([2]), np.array([1]))[0], 0.5)
+
+        self.brain.G.add_edge(2, 4, weight=0.3)
+        self.brain.reconstructAdjMat()
+        np.testing.assert_array_equal(np.sort(self.brain.edgeWeights()), [0.3, 0.5, 0.9])
+
+    def test_edgePropertyLabels(self):
+        ''' edge property columns and highlights work with nodes that aren't integers '''
+
+        br = recipes.loadAndThreshold(self.fnameAdj, self.fnameCo, 0.5)
+        a, b = br.G.edges()[0]
+        br.setEdgePropertyArray('length', np.array([a]), np.array([b]), np.array([2.5]))
+        br.G.add_node('0R', xyz=(1.,2.,3.))
+        br.G.add_edge(a, '0R', weight=0.7)
+
+        vals, has = br.edgePropertyArray('length', [(a,b), (a,'0R')])
+        self.assertEqual(has.tolist(), [True, False])
+        self.assertEqual(vals[0], 2.5)
+
+        br.highlightFromConds('length', 'gt', 1., label = 'l1', mode = 'edge')
+        self.assertEqual(len(br.highlights['l1'].edgeIndices), 1)
+        h = mb.brainObjs.highlightObj(edges = [(a,'0R')])
+        x1, y1, z1, x2, y2, z2, s = h.getEdgeCoordsToPlot(br)
+        self.assertEqual(s, [0.7])
+
+    def test_forkEdgeAttributes(self):
+        ''' forks share the array graph until G's edges or their attributes change '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.importSpatialInfo(self.fnameCo)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+
+        br1 = self.brain.fork()
+        br2 = self.brain.fork()
+        self.assertTrue(br1.core is br2.core)
+
+        self.brain.weightToDistance()
+        br3 = self.brain.fork()
+        self.assertEqual(sorted(br3.G.edges(data=True)), sorted(self.brain.G.edges(data=True)))
+        self.assertTrue(all(['distance' in d for a,b,d in br3.G.edges(data=True)]))
+
+    def test_pathLengthsEdgeProperties(self):
+        ''' path lengths by an edge property are found again when it changes '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 4)
+        G = self.brain.G
+
+        self.brain.weightToDistance()
+        paths = self.brain.pathLengths('distance')
+        for e in G.edges():
+            G.edge[e[0]][e[1]]['weight'] = 2. * G.edge[e[0]][e[1]]['weight']
+        self.brain.weightToDistance()
+
+        nodes, D = self.brain.pathLengths('distance')
+        self.assertFalse(np.all(D == paths[1]))
+        self.assertEqual(D.tolist(), mb.pathLengths(G, weight='distance')[1].tolist())
+
+        self.brain.addEdgeProperty('distance', G.edges(), [1.] * G.number_of_edges())
+        self.assertEqual(self.brain.pathLengths('distance')[1].tolist(), self.brain.pathLengths()[1].tolist())
+
+    def test_efficiencyBlocks(self):
+        ''' efficiencies found a block of source nodes at a time match those from the whole path matrix '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 4)
+        G = self.brain.G
+        paths = mb.pathLengths(G, weight='weight')
+
+        blockSize = mb.extraFns.pathBlockSize
+        mb.extraFns.pathBlockSize = 3
+        try:
+            self.assertAlmostEqual(mb.globalefficiency(G, weight='weight'), mb.globalefficiency(G, paths=paths))
+            nodEff = mb.nodalefficiency(G)
+            for v,e in mb.nodalefficiency(G, paths=mb.pathLengths(G)).items():
+                self.assertAlmostEqual(nodEff[v], e)
+            locEff = mb.localefficiency(G, weight='weight', fc=True)
+            for v,e in mb.localefficiency(G, weight='weight', fc=True, paths=paths).items():
+                self.assertAlmostEqual(locEff[v], e)
+        finally:
+            mb.extraFns.pathBlockSize = blockSize
+
+    def test_localefficiency(self):
+        ''' local efficiency matches the efficiency of each neighbourhood found by networkx '''
+
+        G = nx.Graph()
+        G.add_weighted_edges_from([(0,1,1.), (0,2,2.), (1,2,0.5), (2,3,1.), (3,0,3.), (3,4,1.), (4,5,2.)])
+        G.add_node(6)
+
+        for weight in [None, 'weight']:
+            locEff = mb.localefficiency(G, weight=weight)
+            for v in G.nodes():
+                nbrs = G.neighbors(v)
+                Gi = G.subgraph(nbrs + [v])
+                if nbrs:
+                    e = np.sum([mb.efficiencyfunc(u, Gi, weight=weight) for u in nbrs]) / len(nbrs)
+                else:
+                    e = 0.
+                self.assertAlmostEqual(locEff[v], e)
+
+    def test_parseAdjLinesRagged(self):
+        ''' rows with the wrong number of values are not read in to the wrong places '''
+
+        out = np.empty((2,3))
+        mb.parseAdjLines(['1 2 3', '4 NA 6'], out)
+        self.assertEqual(out[1,0], 4.)
+        self.assertTrue(np.isnan(out[1,1]))
+
+        for delimiter in [None, ',']:
+            d = delimiter or ' '
+            lines = [d.join(['1', '2']), d.join(['3', '4', '5', '6'])]
+            with self.assertRaises(ValueError) as cm:
+                mb.parseAdjLines(lines, out, delimiter=delimiter, firstRow=4)
+            self.assertTrue('row 4 ' in str(cm.exception))
+
+    def test_nodeCoordsReplaced(self):
+        ''' node coordinates follow xyz when it is changed in place or replaced '''
+
+        br = recipes.loadAndThreshold(self.fnameAdj, self.fnameCo, 0.5)
+        nodes = br.G.nodes()
+        np.testing.assert_array_equal(br.nodeCoords(nodes), br.coords[nodes])
+
+        br.G.node[nodes[0]]['xyz'][0] = 10.
+        self.assertEqual(br.nodeCoords(nodes)[0,0], 10.)
+
+        br.G.node[nodes[1]]['xyz'] = (1., 2., 3.)
+        xyz = br.nodeCoords(nodes)
+        self.assertEqual(xyz[1].tolist(), [1., 2., 3.])
+        self.assertEqual(xyz[0,0], 10.)
+        np.testing.assert_array_equal(xyz[2:], br.coords[nodes[2:]])
+
+        fork = br.fork()
+        self.assertEqual(fork.nodeCoords(nodes)[1].tolist(), [1., 2., 3.])
+        np.testing.assert_array_equal(fork.nodeCoords(nodes[2:]), br.coords[nodes[2:]])
+
+    def test_undirectedFlatten(self):
+        ''' the flattened upper triangle of a matrix is its packed triangle '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        mat = self.brain.adjMat
+        n = len(mat)
+        flat = mb.undirectedFlatten(mat)
+        np.testing.assert_array_equal(flat, mat[np.triu(np.ones((n,n), dtype=bool), 1)])
+        i, j = np.triu_indices(n, 1)
+        np.testing.assert_array_equal(flat[mb.packIndex(i, j, n)], mat[i,j])
+        self.assertTrue(mb.undirectedFlatten(flat) is flat)
+
+    def test_thresholdSweepDirected(self):
+        ''' a sweep of densities on a directed brain gives the same graphs as thresholding at each one '''
+
+        adjMat = np.random.RandomState(0).rand(8,8)
+        sweep, br = mb.brainObj(directed=True), mb.brainObj(directed=True)
+        for b in [sweep, br]:
+            b.adjMat = adjMat.copy()
+            b.G.add_nodes_from(range(8))
+            b.adjMatChanged()
+
+        for pc,G in sweep.thresholdSweep(range(0, 101, 5)):
+            br.applyThreshold(thresholdType = 'edgePC', value = pc)
+            self.assertEqual(sorted(G.edges(data=True)), sorted(br.G.edges(data=True)))
+
+    def test_componentCurveDirected(self):
+        ''' the densities of the component curve of a directed brain give its graphs in applyThreshold '''
+
+        br = mb.brainObj(directed=True)
+        br.adjMat = np.random.RandomState(1).rand(8,8)
+        br.G.add_nodes_from(range(8))
+        br.adjMatChanged()
+
+        densities, nComps = br.componentCurve()
+        self.assertEqual(list(nComps), range(8, 0, -1))
+        for pc,n in zip(densities[1:], nComps[1:]):
+            br.applyThreshold(thresholdType = 'edgePC', value = pc)
+            self.assertEqual(nx.number_weakly_connected_components(br.G), n)
+            br.applyThreshold(thresholdType = 'edgePC', value = np.nextafter(pc, 0))
+            self.assertEqual(nx.number_weakly_connected_components(br.G), n+1)
+
+    def test_negativeWeightPaths(self):
+        ''' weighted path lengths and efficiencies raise an error for negative weights '''
+
+        G = nx.Graph()
+        G.add_weighted_edges_from([(0,1,1.), (1,2,-0.5), (0,2,2.)])
+
+        self.assertEqual(mb.pathLengths(G)[1][0,2], 1.)
+        for f in [lambda: mb.pathLengths(G, weight='weight'),
+                  lambda: mb.globalefficiency(G, weight='weight'),
+                  lambda: mb.localefficiency(G, weight='weight'),
+                  lambda: mb.localefficiency(G, weight='weight', fc=True)]:
+            self.assertRaises(ValueError, f)
+
+    def test_forkKeepsChanges(self):
+        ''' a fork keeps its edge changes in the journal until it reads the shared matrix '''
+
+        import pickle
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+        adjMat = self.brain.adjMat.copy()
+
+        br = self.brain.fork()
+        a, b = br.G.edges()[0]
+        br.G.remove_edge(a, b)
+        br.logEdge((a, b))
+        br.syncAdjMat()
+        self.assertFalse('adjMat' in br.__dict__)
+        self.assertEqual(len(br.edgeJournal), 1)
+
+        # forks and pickles of the fork keep the change without the parent seeing it
+        for b2 in [br.fork(), pickle.loads(pickle.dumps(br, 2)), br]:
+            self.assertTrue(np.isnan(b2.adjMat[a,b]))
+            self.assertTrue(np.isnan(b2.adjMat[b,a]))
+            self.assertEqual(b2.edgeJournal, [])
+        np.testing.assert_array_equal(self.brain.adjMat, adjMat)
+
+    def test_forkHighlights(self):
+        ''' highlights of a fork can be changed without changing the original's '''
+
+        self.brain.importAdjFile(self.fnameAdj)
+        self.brain.applyThreshold(thresholdType = 'totalEdges', value = 3)
+        self.brain.highlightFromConds('weight', 'gt', 0.5, label='strong', mode='edge')
+        edges = list(self.brain.highlights['strong'].edgeIndices)
+
+        br = self.brain.fork()
+        br.highlights['strong'].edgeIndices.append((0, 0))
+        br.highlights['strong'].colour = (0., 1., 0.)
+        self.assertEqual(self.brain.highlights['strong'].edgeIndices, edges)
+        self.assertEqual(self.brain.highlights['strong'].colour, (1., 0., 0.))
+
     def test_loadAndPlot(self):
         ''' load, threhsold and plot '''
         
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+
+Some unit tests for Maybrain cohorts - loading of groups of subjects
+
+"""
+
+import os
+import multiprocessing
+import unittest
+import numpy as np
+import maybrain as mb
+
+
+class TestSequenceFunctions(unittest.TestCase):
+
+    def setUp(self):
+        ''' load inital parameters and/or data for testing'''
+        self.fnameAdj = 'data/3d_grid_adj.txt'
+
+        self.cohort = mb.cohortObj()
+
+    #### loading things
+    def test_loadAdjFiles(self):
+        ''' test loading several subjects in to one array '''
+
+        self.cohort.importAdjFiles([self.fnameAdj, self.fnameAdj], exclnodes={self.fnameAdj:[1]}, processes=2)
+
+        br = mb.brainObj()
+        br.importAdjFile(self.fnameAdj, exclnodes=[1])
+
+        self.assertEqual(self.cohort.adjMats.shape, (2,4,4))
+        np.testing.assert_array_equal(self.cohort.adjMats[1], br.adjMat)
+        np.testing.assert_array_equal(self.cohort.masks[0], np.isnan(br.adjMat))
+
+    def test_loadAdjFilesFails(self):
+        ''' a subject that can't be loaded raises its error and stops the process pool '''
+
+        fname = 'data/temp_small_adj.txt'
+        with open(fname, 'w') as f:
+            f.write('0 1 1\n1 0 1\n1 1 0\n')
+        try:
+            with self.assertRaises(ValueError):
+                self.cohort.importAdjFiles([self.fnameAdj, fname, self.fnameAdj], processes=2)
+        finally:
+            os.remove(fname)
+
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_subjectBrain(self):
+        ''' test making a brain for one subject '''
+
+        self.cohort.importAdjFiles([self.fnameAdj, self.fnameAdj], processes=1)
+
+        br = self.cohort.brain(1)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2)
+
+        self.assertEqual(len(br.G.edges()), 2)
+
+    def test_thresholdSubjects(self):
+        ''' test thresholding all subjects at once gives the same edges as each brain '''
+
+        self.cohort.importAdjFiles([self.fnameAdj, self.fnameAdj], exclnodes={self.fnameAdj:[1]}, processes=1)
+        edges = self.cohort.thresholdSubjects('edgePC', 50, blockSize=1)
+
+        br = self.cohort.brain(0)
+        br.applyThreshold(thresholdType = 'edgePC', value = 50)
+
+        i, j, w = edges[1]
+        self.assertEqual(sorted(zip(i, j)), sorted(br.G.edges()))
+        self.assertEqual(self.cohort.thresholds[1], br.threshold)
+        degrees = self.cohort.subjectDegrees()
+        self.assertEqual([degrees[0,v] for v in br.G.nodes()], [br.G.degree(v) for v in br.G.nodes()])
+
+    def test_consensusBrain(self):
+        ''' test consensus edges are those kept in enough subjects '''
+
+        br = self.cohort.consensusBrain(presence=100, thresholdType='totalEdges', value=2,
+                                        fnames=[self.fnameAdj, self.fnameAdj])
+
+        br1 = mb.brainObj()
+        br1.importAdjFile(self.fnameAdj)
+        br1.applyThreshold(thresholdType = 'totalEdges', value = 2)
+
+        self.assertEqual(sorted([(a,b,d['weight']) for a,b,d in br.G.edges(data=True)]),
+                         sorted([(a,b,d['weight']) for a,b,d in br1.G.edges(data=True)]))
+        np.testing.assert_array_equal(mb.undirectedFlatten(br.adjMat), mb.undirectedFlatten(br1.adjMat))
+        e = br.G.edges()[0]
+        self.assertEqual(br.G.edge[e[0]][e[1]]['presence'], 1.)
+        self.assertEqual(br.G.edge[e[0]][e[1]]['cv'], 0.)
+
+    def test_subjectBrainReadOnly(self):
+        ''' changing a subject's brain doesn't change the cohort '''
+
+        self.cohort.importAdjFiles([self.fnameAdj], processes=1)
+        adjMats = self.cohort.adjMats.copy()
+
+        br = self.cohort.brain(0)
+        br.applyThreshold(thresholdType = 'totalEdges', value = 2)
+        a, b = br.G.edges()[0]
+        br.G.remove_edge(a, b)
+        br.updateAdjMat((a, b))
+
+        self.assertTrue(np.isnan(br.adjMat[a,b]))
+        np.testing.assert_array_equal(self.cohort.adjMats, adjMats)
+
+    def test_consensusBrainEmpty(self):
+        ''' a consensus of no subjects is an error '''
+
+        self.assertRaises(ValueError, self.cohort.consensusBrain, fnames=[])
+
+
+if __name__ == '__main__':
+    unittest.main()